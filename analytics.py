@@ -0,0 +1,312 @@
+import threading
+from datetime import date, timedelta
+import numpy as np
+import budget
+import db
+
+EPOCH = date(1970, 1, 1)
+TYPE_INCOME = 0
+TYPE_EXPENSE = 1
+
+
+def to_day(value):
+    """Days since 1970-01-01 for a date or 'YYYY-MM-DD' string."""
+    if isinstance(value, str):
+        value = date.fromisoformat(value)
+    return (value - EPOCH).days
+
+
+def day_to_date(day):
+    return EPOCH + timedelta(days=int(day))
+
+
+def month_index(year, month):
+    """Months since 1970-01, the unit used for monthly group-bys."""
+    return (year - 1970) * 12 + month - 1
+
+
+def month_label(index):
+    year, month = divmod(int(index), 12)
+    return f'{1970 + year:04d}-{month + 1:02d}'
+
+
+class _Column:
+    """A NumPy array that grows by doubling so incremental appends stay amortized O(1)."""
+
+    def __init__(self, dtype, capacity=1024):
+        self.data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+    def extend(self, values):
+        needed = self.size + len(values)
+        if needed > len(self.data):
+            grown = np.empty(max(needed, 2 * len(self.data)), dtype=self.data.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+        self.data[self.size:needed] = values
+        self.size = needed
+
+    def view(self):
+        return self.data[:self.size]
+
+
+class AnalyticsSnapshot:
+    """
+    Columnar in-memory copy of (date, type, category, amount, savings goal) for every transaction.
+
+    Rows are loaded once, then refresh() appends only rows above the high-water-mark transaction_id.
+    Updates and deletes (detected through the data generation counters) trigger a full reload.
+    Amounts are held as integer cents so group-by sums are exact.
+
+    Archived months (see archive.py) are loaded from their stored totals, one row per
+    (month, type, category, goal) dated on the first of the month, so monthly figures stay exact.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.days = _Column(np.int32)
+        self.months = _Column(np.int32)
+        self.types = _Column(np.int8)
+        self.category_ids = _Column(np.int32)
+        self.cents = _Column(np.int64)
+        self.goal_ids = _Column(np.int32)
+        self.categories = []
+        self.category_index = {}
+        self.high_water_mark = 0
+        self.archived_rows = 0
+        self.generation = None
+        self.rewrite_generation = None
+
+    def _category_id(self, name):
+        category_id = self.category_index.get(name)
+        if category_id is None:
+            category_id = len(self.categories)
+            self.category_index[name] = category_id
+            self.categories.append(name)
+        return category_id
+
+    def refresh(self):
+        """Brings the snapshot up to date. Only reads the data generation row when nothing changed."""
+        generation, rewrite_generation = budget.get_data_generation()
+        if generation == self.generation:
+            return
+        with self._lock:
+            if generation == self.generation:
+                return
+            if rewrite_generation != self.rewrite_generation:
+                self._reload()
+            if not self._append_new_rows():
+                # A lower transaction_id committed after a higher one we already hold: start over
+                self._reload()
+                self._append_new_rows()
+            self.generation = generation
+            self.rewrite_generation = rewrite_generation
+
+    def _reload(self):
+        # Archiving deletes rows, which moves rewrite_generation, so the archived totals are only read here
+        self._reset()
+        self._append_archived_totals()
+
+    def _append_archived_totals(self):
+        conn = db.get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT month - DATE '1970-01-01', "
+                    "(EXTRACT(YEAR FROM month)::int - 1970) * 12 + EXTRACT(MONTH FROM month)::int - 1, "
+                    "type = 'expense', category, ROUND(SUM(total) * 100)::bigint, savings_goal_id "
+                    "FROM archived_totals GROUP BY month, type, category, savings_goal_id;"
+                )
+                rows = cur.fetchall()
+        finally:
+            db.release_db_connection(conn)
+        if rows:
+            self._extend(rows)
+            self.archived_rows = len(rows)
+
+    def _extend(self, rows):
+        days, months, is_expense, categories, cents, goal_ids = zip(*rows)
+        self.days.extend(np.fromiter(days, dtype=np.int32, count=len(rows)))
+        self.months.extend(np.fromiter(months, dtype=np.int32, count=len(rows)))
+        self.types.extend(np.fromiter(is_expense, dtype=np.int8, count=len(rows)))
+        self.category_ids.extend(np.fromiter((self._category_id(c) for c in categories), dtype=np.int32, count=len(rows)))
+        self.cents.extend(np.fromiter(cents, dtype=np.int64, count=len(rows)))
+        self.goal_ids.extend(np.fromiter(goal_ids, dtype=np.int32, count=len(rows)))
+
+    def _append_new_rows(self):
+        """Appends rows above the high-water mark. Returns False if rows below it are missing from the snapshot."""
+        conn = db.get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                # One snapshot for the rows and the count, so a concurrent insert cannot look like a gap
+                cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY;")
+                # Let Postgres do the date/amount conversions so Python only sees ints
+                cur.execute(
+                    "SELECT transaction_id, date - DATE '1970-01-01', "
+                    "(EXTRACT(YEAR FROM date)::int - 1970) * 12 + EXTRACT(MONTH FROM date)::int - 1, "
+                    "type = 'expense', category, ROUND(amount * 100)::bigint, COALESCE(savings_goal_id, 0) "
+                    "FROM transactions WHERE transaction_id > %s ORDER BY transaction_id;",
+                    (self.high_water_mark,)
+                )
+                rows = cur.fetchall()
+                # The monthly checkpoints hold the hot row count (see budget.count_transactions())
+                cur.execute("SELECT COALESCE(SUM(transaction_count), 0) FROM monthly_balances;")
+                total_rows = cur.fetchone()[0]
+        finally:
+            db.release_db_connection(conn)
+        if not rows:
+            return self.cents.size - self.archived_rows == total_rows
+
+        self._extend([row[1:] for row in rows])
+        self.high_water_mark = rows[-1][0]
+        return self.cents.size - self.archived_rows == total_rows
+
+    def _select(self, start_date=None, end_date=None, transaction_type=None):
+        """Boolean mask for rows with start_date <= date <= end_date (either bound optional)."""
+        days = self.days.view()
+        mask = np.ones(len(days), dtype=bool)
+        if start_date is not None:
+            mask &= days >= to_day(start_date)
+        if end_date is not None:
+            mask &= days <= to_day(end_date)
+        if transaction_type is not None:
+            mask &= self.types.view() == (TYPE_EXPENSE if transaction_type == 'expense' else TYPE_INCOME)
+        return mask
+
+    def _month_range(self, mask, start_date, end_date):
+        months = self.months.view()[mask]
+        if start_date is not None:
+            first = month_index(*date.fromisoformat(str(start_date)).timetuple()[:2])
+        else:
+            first = int(months.min()) if len(months) else 0
+        if end_date is not None:
+            last = month_index(*date.fromisoformat(str(end_date)).timetuple()[:2])
+        else:
+            last = int(months.max()) if len(months) else -1
+        return first, last
+
+    def category_matrix(self, first_month, last_month, transaction_type):
+        """
+        Raw (categories, cents) where cents is a float array of shape (months, categories)
+        for month indexes first_month..last_month inclusive. Categories without rows are kept.
+        """
+        month_count = max(last_month - first_month + 1, 0)
+        with self._lock:
+            months = self.months.view()
+            mask = (months >= first_month) & (months <= last_month)
+            mask &= self.types.view() == (TYPE_EXPENSE if transaction_type == 'expense' else TYPE_INCOME)
+            category_count = len(self.categories)
+            keys = (months[mask] - first_month) * category_count + self.category_ids.view()[mask]
+            cents = np.bincount(keys, weights=self.cents.view()[mask], minlength=month_count * category_count)
+            categories = list(self.categories)
+        return categories, cents.reshape(month_count, category_count)
+
+    def goal_matrix(self, first_month, last_month, goal_ids):
+        """Goal Savings contributions in cents, shape (months, len(goal_ids)), for the given goal ids."""
+        month_count = max(last_month - first_month + 1, 0)
+        goal_ids = np.asarray(goal_ids, dtype=np.int32)
+        with self._lock:
+            months = self.months.view()
+            goals = self.goal_ids.view()
+            mask = (months >= first_month) & (months <= last_month) & (self.types.view() == TYPE_EXPENSE)
+            mask &= np.isin(goals, goal_ids)
+            columns = np.searchsorted(np.sort(goal_ids), goals[mask])
+            order = np.argsort(goal_ids)
+            keys = (months[mask] - first_month) * len(goal_ids) + order[columns]
+            cents = np.bincount(keys, weights=self.cents.view()[mask], minlength=month_count * len(goal_ids))
+        return cents.reshape(month_count, len(goal_ids))
+
+    def balance(self):
+        """All-time income minus expense, in cents."""
+        with self._lock:
+            cents = self.cents.view()
+            is_income = self.types.view() == TYPE_INCOME
+            return int(cents[is_income].sum() - cents[~is_income].sum())
+
+    def monthly_by_category(self, start_date=None, end_date=None, transaction_type='expense'):
+        """
+        Totals per (month, category) over the range, as a dense matrix.
+        Returns {'months': [...], 'categories': [...], 'totals': [[month x category]]}.
+        """
+        with self._lock:
+            mask = self._select(start_date, end_date, transaction_type)
+            first, last = self._month_range(mask, start_date, end_date)
+            month_count = max(last - first + 1, 0)
+            category_count = len(self.categories)
+            if month_count == 0 or category_count == 0:
+                return {'months': [], 'categories': [], 'totals': []}
+
+            # One bincount over a flattened (month, category) key does the whole group-by
+            keys = (self.months.view()[mask] - first) * category_count + self.category_ids.view()[mask]
+            totals = np.bincount(keys, weights=self.cents.view()[mask], minlength=month_count * category_count)
+            totals = totals.reshape(month_count, category_count)
+            used = totals.any(axis=0)
+            categories = [name for name, keep in zip(self.categories, used) if keep]
+
+        return {
+            'months': [month_label(first + i) for i in range(month_count)],
+            'categories': categories,
+            'totals': (totals[:, used] / 100).round(2).tolist(),
+        }
+
+    def monthly_totals(self, start_date=None, end_date=None):
+        """Income, expense and balance per month, plus the running (cumulative) balance."""
+        with self._lock:
+            mask = self._select(start_date, end_date)
+            first, last = self._month_range(mask, start_date, end_date)
+            month_count = max(last - first + 1, 0)
+            if month_count == 0:
+                return {'months': [], 'income': [], 'expense': [], 'balance': [], 'cumulative_balance': []}
+
+            months = self.months.view()[mask] - first
+            types = self.types.view()[mask]
+            cents = self.cents.view()[mask]
+            income = np.bincount(months, weights=np.where(types == TYPE_INCOME, cents, 0), minlength=month_count)
+            expense = np.bincount(months, weights=np.where(types == TYPE_EXPENSE, cents, 0), minlength=month_count)
+
+        balance = income - expense
+        return {
+            'months': [month_label(first + i) for i in range(month_count)],
+            'income': (income / 100).round(2).tolist(),
+            'expense': (expense / 100).round(2).tolist(),
+            'balance': (balance / 100).round(2).tolist(),
+            'cumulative_balance': (np.cumsum(balance) / 100).round(2).tolist(),
+        }
+
+    def daily_cumulative_balance(self, start_date, end_date):
+        """Running balance for every day in the range, starting from the balance carried in before start_date."""
+        first, last = to_day(start_date), to_day(end_date)
+        day_count = max(last - first + 1, 0)
+        with self._lock:
+            days = self.days.view()
+            signed = np.where(self.types.view() == TYPE_INCOME, self.cents.view(), -self.cents.view())
+            opening = signed[days < first].sum()
+            mask = (days >= first) & (days <= last)
+            per_day = np.bincount(days[mask] - first, weights=signed[mask], minlength=day_count)
+        return {
+            'days': [day_to_date(first + i).isoformat() for i in range(day_count)],
+            'balance': ((opening + np.cumsum(per_day)) / 100).round(2).tolist(),
+        }
+
+
+def rolling_mean(values, window):
+    """Trailing moving average; the first window-1 points average over what is available."""
+    values = np.asarray(values, dtype=float)
+    if window <= 1 or len(values) == 0:
+        return values.round(2).tolist()
+    sums = np.cumsum(np.insert(values, 0, 0.0))
+    counts = np.minimum(np.arange(1, len(values) + 1), window)
+    windowed = sums[1:] - sums[np.maximum(np.arange(1, len(values) + 1) - window, 0)]
+    return (windowed / counts).round(2).tolist()
+
+
+_snapshot = AnalyticsSnapshot()
+
+
+def get_snapshot():
+    """The process-wide snapshot, refreshed against the database's data generation."""
+    _snapshot.refresh()
+    return _snapshot
@@ -1,20 +1,40 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, g, abort
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_mail import Mail, Message
 from itsdangerous import URLSafeTimedSerializer, SignatureExpired, BadTimeSignature
+from psycopg2.errors import QueryCanceled
 import budget as budget_logic
 import settings_manager
 import savings_goals as savings_goals_logic
-from datetime import datetime
+from datetime import date, datetime
+from decimal import Decimal
+import hashlib
+import json
+import mimetypes
 import os
 import pyotp
 import base64
+import time
 from functools import wraps
 
 import db  # Import the new db module
+import throttle
+import analytics
+import forecast
+import changefeed
+import assets
+import report_pdf
+import profiler
+import recurring
+import archive
 
 app = Flask(__name__)
+# Proxies in front of the app whose X-Forwarded-For/-Proto entries are trusted. 0 (run directly, as with
+# app.run or start_budget_tracker.bat) ignores the headers, so clients can't pick their own address.
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 0))
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS)
 app.secret_key = os.urandom(24)
 app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER')
 app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587))
@@ -34,6 +54,122 @@ login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Wall-clock time all the queries behind a request may take before Postgres cancels them
+PAGE_QUERY_SECONDS = float(os.environ.get('PAGE_QUERY_SECONDS', 5))
+REPORT_QUERY_SECONDS = float(os.environ.get('REPORT_QUERY_SECONDS', 15))
+EXPORT_QUERY_SECONDS = float(os.environ.get('EXPORT_QUERY_SECONDS', 30))
+# Rows in the report's top merchants table
+TOP_ITEMS = int(os.environ.get('TOP_ITEMS', 10))
+
+# Registered before the other hooks: before_request hooks run in order and after_request hooks in
+# reverse, so the profile covers everything else the app does for the request.
+@app.before_request
+def start_profile():
+    """Admins can profile a single request by adding ?_profile=1 or an X-Profile: 1 header."""
+    if ((request.args.get(profiler.PROFILE_PARAM) or request.headers.get(profiler.PROFILE_HEADER))
+            and current_user.is_authenticated and current_user.role == 'admin'):
+        g.profile = profiler.start(request.method, request.full_path, current_user.username)
+
+@app.after_request
+def finish_profile(response):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profiler.finish(profile, response.status_code)
+        response.headers['X-Profile-Id'] = profile.id
+        response.headers['Server-Timing'] = profile.server_timing()
+    return response
+
+@app.teardown_request
+def abandon_profile(exc):
+    # after_request doesn't run when a view raises; keep the profile of the failed request too
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profiler.finish(profile, 500)
+
+@app.before_request
+def route_reads():
+    """Reads go to a replica unless this request writes, or this session wrote recently and must see its own changes."""
+    recently_wrote = time.time() - session.get('last_write_at', 0) < db.READ_YOUR_WRITES_SECONDS
+    db.begin_request(pin_reads_to_primary=request.method not in SAFE_METHODS or recently_wrote)
+
+@app.before_request
+def watch_client_connection():
+    # Lets db cancel budgeted queries whose client has already gone away
+    db.set_client_socket(request.environ.get('gunicorn.socket') or request.environ.get('werkzeug.socket'))
+
+@app.before_request
+def start_recurring_scheduler():
+    # Started on the first request rather than at import, so it runs in each worker after gunicorn forks
+    recurring.start_scheduler()
+
+@app.after_request
+def remember_write(response):
+    if db.REPLICA_DATABASE_URLS and db.committed_in_request():
+        session['last_write_at'] = time.time()
+    return response
+
+@app.after_request
+def compress_response(response):
+    """Gzip/brotli for HTML, JSON and other text bodies above assets.COMPRESS_MIN_BYTES."""
+    if (response.direct_passthrough or response.is_streamed or response.status_code < 200
+            or response.status_code in (204, 304) or 'Content-Encoding' in response.headers
+            or response.mimetype not in assets.COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    encoding = assets.choose_encoding(request.accept_encodings)
+    if encoding and len(body) >= assets.COMPRESS_MIN_BYTES:
+        response.set_data(assets.compress(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+@app.template_global()
+def asset_url(filename):
+    """Content-hashed URL for a file under static/. Vendored libraries fall back to their CDN until downloaded."""
+    name = assets.hashed_name(filename)
+    if name is None:
+        return assets.cdn_url(filename) or url_for('static', filename=filename)
+    return url_for('asset', name=name)
+
+def requested_live_regions():
+    """The [data-live-region] ids static/live.js asked for; empty when the whole page is wanted."""
+    return request.args.getlist('live_region')
+
+def render_live_regions(template_name, regions, **context):
+    """
+    Renders only the given live regions of a page, so a data change costs a fragment rather than the page.
+    Each region's markup sits in a {% block live_<id> %} (hyphens as underscores) of the template.
+    """
+    template = app.jinja_env.get_template(template_name)
+    app.update_template_context(context)
+    template_context = template.new_context(context)
+    fragments = []
+    for region in regions:
+        block = template.blocks.get('live_' + region.replace('-', '_'))
+        if block is not None:
+            fragments.append(''.join(block(template_context)))
+    return ''.join(fragments)
+
+@app.route('/assets/<path:name>')
+def asset(name):
+    encoding = assets.choose_encoding(request.accept_encodings)
+    body, used_encoding = assets.load_asset(name, encoding)
+    if body is None:
+        return 'Not found', 404
+    response = app.response_class(body, mimetype=mimetypes.guess_type(name)[0] or 'application/octet-stream')
+    # The name changes whenever the content does, so browsers never need to revalidate
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response.vary.add('Accept-Encoding')
+    if used_encoding:
+        response.headers['Content-Encoding'] = used_encoding
+    return response
+
+def client_ip():
+    """The client address: the peer, or the address the trusted proxies saw (see TRUSTED_PROXY_HOPS)."""
+    return request.remote_addr
+
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -43,6 +179,44 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def query_budget(seconds, heavy=False):
+    """
+    Runs the view's queries under db.query_budget(seconds). Heavy views (reports, exports, trends) also
+    refuse users whose requests keep running out of time for a while, so one heavy user can't tie up
+    the whole connection pool; everyday pages keep working for them under the plain time limit.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if heavy:
+                throttle.check_heavy_queries_allowed(current_user.get_id())
+            with db.query_budget(seconds):
+                return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+def query_error_response(message, status):
+    if request.path.startswith('/api/'):
+        return api_response({'error': message}, status)
+    if request.headers.get('X-Requested-With') == 'fetch':
+        # Fragments fetched by page scripts; they show their own message
+        return message, status
+    return render_template('query_timeout.html', message=message), status
+
+@app.errorhandler(QueryCanceled)
+@app.errorhandler(db.QueryBudgetExceeded)
+def query_cancelled(e):
+    # Postgres says "due to user request" when db cancelled the statement because the client left
+    reason = 'client disconnected' if 'user request' in str(e) else 'timeout'
+    throttle.record_query_timeout(request.endpoint, reason, current_user.get_id())
+    return query_error_response('This request took too long and was stopped. '
+                                'Try a shorter date range or a narrower search.', 503)
+
+@app.errorhandler(throttle.TooManyTimeouts)
+def too_many_timeouts(e):
+    return query_error_response('Several of your recent requests ran out of time. '
+                                'Please wait a few minutes before loading large reports again.', 429)
+
 class User(UserMixin):
     def __init__(self, id, username, email, password_hash, role='user', totp_secret=None):
         self.id = id
@@ -52,11 +226,16 @@ class User(UserMixin):
         self.role = role
         self.totp_secret = totp_secret
 
+# The user loader runs this on every request; logins and password resets use the other two
+db.register_statement('user_by_id', "SELECT * FROM users WHERE id = %s;")
+db.register_statement('user_by_username', "SELECT * FROM users WHERE username = %s;")
+db.register_statement('user_by_email', "SELECT * FROM users WHERE email = %s;")
+
 def get_user_by_username(username):
-    conn = db.get_db_connection()
+    conn = db.get_read_connection()
     try:
         with conn.cursor() as cur:
-            cur.execute("SELECT * FROM users WHERE username = %s;", (username,))
+            db.execute_statement(cur, 'user_by_username', (username,))
             user_data = cur.fetchone()
             if user_data:
                 return User(id=user_data[0], username=user_data[1], email=user_data[2], password_hash=user_data[3], role=user_data[4], totp_secret=user_data[5])
@@ -65,10 +244,10 @@ def get_user_by_username(username):
     return None
 
 def get_user_by_email(email):
-    conn = db.get_db_connection()
+    conn = db.get_read_connection()
     try:
         with conn.cursor() as cur:
-            cur.execute("SELECT * FROM users WHERE email = %s;", (email,))
+            db.execute_statement(cur, 'user_by_email', (email,))
             user_data = cur.fetchone()
             if user_data:
                 return User(id=user_data[0], username=user_data[1], email=user_data[2], password_hash=user_data[3], role=user_data[4], totp_secret=user_data[5])
@@ -77,10 +256,10 @@ def get_user_by_email(email):
     return None
 
 def get_user_by_id(user_id):
-    conn = db.get_db_connection()
+    conn = db.get_read_connection()
     try:
         with conn.cursor() as cur:
-            cur.execute("SELECT * FROM users WHERE id = %s;", (user_id,))
+            db.execute_statement(cur, 'user_by_id', (user_id,))
             user_data = cur.fetchone()
             if user_data:
                 return User(id=user_data[0], username=user_data[1], email=user_data[2], password_hash=user_data[3], role=user_data[4], totp_secret=user_data[5])
@@ -129,6 +308,35 @@ def admin_users():
     users = get_all_users()
     return render_template('admin_users.html', users=users)
 
+@app.route('/admin/profiles')
+@login_required
+@admin_required
+def admin_profiles():
+    return render_template('admin_profiles.html', profiles=profiler.recent_profiles(),
+                           profile_param=profiler.PROFILE_PARAM, max_profiles=profiler.MAX_PROFILES,
+                           query_timeouts=throttle.query_timeouts.most_common())
+
+@app.route('/admin/profiles/<profile_id>')
+@login_required
+@admin_required
+def admin_profile(profile_id):
+    profile = profiler.get_profile(profile_id)
+    if profile is None:
+        flash('That profile is no longer kept.', 'warning')
+        return redirect(url_for('admin_profiles'))
+    return render_template('admin_profile.html', profile=profile)
+
+@app.route('/admin/profiles/<profile_id>/download')
+@login_required
+@admin_required
+def download_profile(profile_id):
+    profile = profiler.get_profile(profile_id)
+    if profile is None:
+        abort(404)
+    response = jsonify(profile.as_dict())
+    response.headers['Content-Disposition'] = f'attachment; filename="profile-{profile.id}.json"'
+    return response
+
 @app.route('/admin/users/delete/<int:user_id>')
 @login_required
 @admin_required
@@ -201,7 +409,17 @@ def change_password():
         new_password = request.form.get('new_password')
         confirm_password = request.form.get('confirm_password')
 
-        if not check_password_hash(current_user.password_hash, current_password):
+        try:
+            throttle.check_login_allowed(current_user.username, client_ip())
+            password_ok = throttle.verify_password(current_user.password_hash, current_password)
+        except throttle.TooManyAttempts:
+            flash('Too many attempts. Please wait a minute and try again.', 'danger')
+            return render_template('change_password.html'), 429
+        except throttle.HashingBusy:
+            flash('The server is busy. Please try again in a moment.', 'warning')
+            return render_template('change_password.html'), 503
+
+        if not password_ok:
             flash('Incorrect current password.', 'danger')
             return redirect(url_for('change_password'))
 
@@ -215,6 +433,7 @@ def change_password():
 
         new_password_hash = generate_password_hash(new_password, method='pbkdf2:sha256')
         update_user_password(current_user.id, new_password_hash)
+        throttle.record_login_success(current_user.username)
         
         flash('Your password has been changed successfully.', 'success')
         return redirect(url_for('settings'))
@@ -229,9 +448,25 @@ def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        user = get_user_by_username(username)
+        started = time.monotonic()
 
-        if user and check_password_hash(user.password_hash, password):
+        try:
+            # Throttle before touching the database or the (expensive) password hash
+            throttle.check_login_allowed(username, client_ip())
+            user = get_user_by_username(username)
+            if user:
+                password_ok = throttle.verify_password(user.password_hash, password)
+            else:
+                password_ok = throttle.reject_unknown_user(started)
+        except throttle.TooManyAttempts:
+            flash('Too many login attempts. Please wait a minute and try again.', 'danger')
+            return render_template('login.html'), 429
+        except throttle.HashingBusy:
+            flash('The server is busy. Please try again in a moment.', 'warning')
+            return render_template('login.html'), 503
+
+        if user and password_ok:
+            throttle.record_login_success(username)
             if user.totp_secret:
                 session['temp_user_id'] = user.id
                 return redirect(url_for('verify_2fa'))
@@ -354,8 +589,12 @@ def register():
 
 # ... (The rest of the routes will be refactored in subsequent steps) ...
 
+# Rows shown in the dashboard's live "Recent Transactions" card
+RECENT_TRANSACTIONS = 5
+
 @app.route('/', methods=['GET', 'POST'])
 @login_required
+@query_budget(PAGE_QUERY_SECONDS)
 def index():
     # Load settings dynamically to ensure latest categories and icons are used
     app_settings = settings_manager.get_settings()
@@ -366,35 +605,21 @@ def index():
     savings_goals = savings_goals_logic.get_savings_goals()
 
     if request.method == 'POST':
-        transaction_type = request.form.get('type')
-        item = request.form.get('item')
-        amount = float(request.form.get('amount', 0))
-        date = request.form.get('date', datetime.now().strftime('%Y-%m-%d'))
-        description = request.form.get('description', '')
-        savings_goal_id = request.form.get('savings_goal_id')
-
-        if transaction_type == 'income' and item and amount > 0:
-            category = request.form.get('category')
-            if category in current_income_categories:
-                budget_logic.add_transaction('income', category, item, amount, date, description)
-        elif transaction_type == 'expense' and item and amount > 0:
-            category = request.form.get('category')
-            transaction_savings_goal_id = request.form.get('savings_goal_id') if category == 'Goal Savings' else ''
-
-            if category in current_expense_categories:
-                if category == 'Goal Savings':
-                    if not transaction_savings_goal_id:
-                        flash('Please select a savings goal for "Goal Savings" category.', 'danger')
-                        return redirect(url_for('index'))
-                    budget_logic.add_transaction('expense', category, item, amount, date, description, transaction_savings_goal_id)
-                    savings_goals_logic.update_saved_amount(transaction_savings_goal_id, amount)
-                else:
-                    budget_logic.add_transaction('expense', category, item, amount, date, description, '')
-        
+        # Validated like every other entry path: Decimal amounts, known categories and goals
+        _, errors = save_transaction_batch([request.form.to_dict()])
+        flash_single_row_errors(errors)
         return redirect(url_for('index'))
 
+    regions = requested_live_regions()
+    if regions:
+        recent_transactions, _ = budget_logic.get_transactions_page(limit=RECENT_TRANSACTIONS)
+        return render_live_regions('index.html', regions, recent_transactions=recent_transactions,
+                                   category_icons=current_category_icons,
+                                   income_category_icons=current_income_category_icons)
+
     all_transactions = budget_logic.get_transactions()
-    savings_goals_logic.recalculate_saved_amounts(all_transactions)
+    # The hot ledger lacks archived months; their contributions come from archived_totals
+    savings_goals_logic.recalculate_saved_amounts(all_transactions, archive.goal_savings_totals())
     return render_template('index.html', 
                            categories=current_expense_categories, 
                            transactions=all_transactions, 
@@ -402,50 +627,356 @@ def index():
                            income_categories=current_income_categories,
                            income_category_icons=current_income_category_icons,
                            savings_goals=savings_goals,
+                           recent_transactions=all_transactions[:RECENT_TRANSACTIONS],
+                           today_date=datetime.now().strftime('%Y-%m-%d'))
+
+# Upper bound on rows accepted by one batch submission
+MAX_BATCH_ROWS = 1000
+
+def flash_single_row_errors(errors):
+    """Flashes validate_transaction_rows() errors for a form holding one row, without the row number."""
+    for error in errors:
+        message = error.removeprefix('Row 1: ')
+        flash(message[:1].upper() + message[1:], 'danger')
+
+def save_transaction_batch(rows):
+    """
+    Validates and inserts a batch of transaction rows in one database transaction,
+    then applies the savings-goal increments aggregated per goal.
+    Returns (inserted_count, errors); nothing is inserted if any row is invalid.
+    """
+    if len(rows) > MAX_BATCH_ROWS:
+        return 0, [f'A batch may contain at most {MAX_BATCH_ROWS} rows.']
+    app_settings = settings_manager.get_settings()
+    goal_ids = [goal['id'] for goal in savings_goals_logic.get_savings_goals()]
+    clean_rows, errors = budget_logic.validate_transaction_rows(rows, app_settings, goal_ids)
+    if errors:
+        return 0, errors
+    inserted = budget_logic.add_transactions(clean_rows)
+    savings_goals_logic.apply_saved_amount_increments(savings_goals_logic.aggregate_goal_increments(clean_rows))
+    return inserted, []
+
+@app.route('/batch', methods=['GET', 'POST'])
+@login_required
+def batch_entry():
+    if request.method == 'POST':
+        fields = ('type', 'category', 'item', 'amount', 'date', 'description', 'savings_goal_id')
+        columns = {field: request.form.getlist(f'{field}[]') for field in fields}
+        row_count = max(len(values) for values in columns.values())
+        rows = []
+        for i in range(row_count):
+            row = {field: (columns[field][i] if i < len(columns[field]) else '') for field in fields}
+            # Skip rows the user left completely blank
+            if row['item'].strip() or row['amount'].strip():
+                rows.append(row)
+
+        inserted, errors = save_transaction_batch(rows)
+        if errors:
+            for error in errors:
+                flash(error, 'danger')
+        else:
+            flash(f'{inserted} transactions added.', 'success')
+            return redirect(url_for('batch_entry'))
+
+    app_settings = settings_manager.get_settings()
+    return render_template('batch_entry.html',
+                           categories=app_settings['expense_categories'],
+                           income_categories=app_settings['income_categories'],
+                           savings_goals=savings_goals_logic.get_savings_goals(),
                            today_date=datetime.now().strftime('%Y-%m-%d'))
 
+@app.route('/api/v1/transactions/batch', methods=['POST'])
+@login_required
+def api_batch_transactions():
+    payload = request.get_json(silent=True)
+    rows = payload.get('transactions') if isinstance(payload, dict) else payload
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        return jsonify({'errors': ['Expected a JSON list of transactions or {"transactions": [...]}.']}), 400
+
+    inserted, errors = save_transaction_batch(rows)
+    if errors:
+        return jsonify({'errors': errors}), 400
+    return jsonify({'inserted': inserted}), 201
+
+API_MAX_LIMIT = 500
+
+def to_json_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+def api_response(payload, status=200):
+    """Compact JSON response; compress_response() takes care of gzip/brotli."""
+    body = json.dumps(payload, separators=(',', ':'), default=to_json_value).encode()
+    return app.response_class(body, status=status, mimetype='application/json')
+
+def parse_api_fields():
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+    return [f.strip() for f in fields.split(',') if f.strip() in budget_logic.TRANSACTION_COLUMNS]
+
+def transactions_to_json(rows, fields=None):
+    # Transaction is a tuple subclass, so it must become a dict before json.dumps sees it
+    if fields:
+        return [{f: row[f] for f in fields} for row in rows]
+    return [row.as_dict() for row in rows]
+
+def parse_api_date(name):
+    value = request.args.get(name)
+    if value:
+        datetime.strptime(value, '%Y-%m-%d')
+    return value
+
+@app.route('/api/v1/transactions')
+@login_required
+@query_budget(PAGE_QUERY_SECONDS)
+def api_transactions():
+    limit = min(max(request.args.get('limit', 50, type=int), 1), API_MAX_LIMIT)
+    fields = parse_api_fields()
+    try:
+        filters = {
+            'type': request.args.get('type'),
+            'category': request.args.get('category'),
+            'item': request.args.get('item'),
+            'search': request.args.get('search'),
+            'since_id': request.args.get('since_id', type=int),
+            'start_date': parse_api_date('start_date'),
+            'end_date': parse_api_date('end_date'),
+        }
+        rows, next_cursor = budget_logic.get_transactions_page(
+            limit=limit, cursor=request.args.get('cursor'), filters=filters, fields=fields
+        )
+    except ValueError as e:
+        return api_response({'error': str(e)}, 400)
+
+    # Archived months aren't listed; /api/v1/report totals still include them
+    archived_count, archived_through = archive.archived_summary()
+    return api_response({
+        'transactions': transactions_to_json(rows, fields),
+        'next_cursor': next_cursor,
+        'archived': {'transactions': archived_count,
+                     'through': f'{archived_through:%Y-%m}' if archived_through else None},
+    })
+
+@app.route('/api/v1/report')
+@login_required
+@query_budget(REPORT_QUERY_SECONDS, heavy=True)
+def api_report():
+    include_rows = request.args.get('rows', '').lower() in ('1', 'true', 'yes')
+    try:
+        report_data = budget_logic.generate_report_data(
+            period=request.args.get('period'),
+            start_date_str=parse_api_date('start_date'),
+            end_date_str=parse_api_date('end_date'),
+            include_transactions=include_rows
+        )
+    except ValueError as e:
+        return api_response({'error': str(e)}, 400)
+
+    if include_rows:
+        report_data['transactions'] = transactions_to_json(report_data['transactions'], parse_api_fields())
+    else:
+        del report_data['transactions']
+    return api_response(report_data)
+
 @app.route('/transactions')
 @login_required
+@query_budget(PAGE_QUERY_SECONDS)
 def transactions():
-    # ... (code remains the same for now)
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
+    per_page = min(max(request.args.get('per_page', 10, type=int), 1), API_MAX_LIMIT)
     search_query = request.args.get('search_query', '').strip()
+    cursor = request.args.get('cursor')
+    newer = request.args.get('direction') == 'newer'
 
-    all_transactions = budget_logic.get_transactions()
-    
-    app_settings = settings_manager.get_settings()
-    current_category_icons = app_settings['category_icons']
-    income_category_icons = app_settings['income_category_icons']
-    
-    # ... (rest of the function)
-    transactions_to_paginate = all_transactions
-    total_transactions = len(transactions_to_paginate)
-    total_pages = (total_transactions + per_page - 1) // per_page
-    start_index = (page - 1) * per_page
-    end_index = start_index + per_page
-    paginated_transactions = transactions_to_paginate[start_index:end_index]
-    return render_template('transactions.html', 
-                           transactions=paginated_transactions, 
-                           category_icons=current_category_icons,
-                           income_category_icons=income_category_icons,
-                           page=page, per_page=per_page, total_pages=total_pages,
-                           total_transactions=total_transactions, search_query=search_query)
+    try:
+        page_transactions, balances, older_cursor, newer_cursor = budget_logic.get_ledger_page(
+            limit=per_page, cursor=cursor, newer=newer, filters={'search': search_query}
+        )
+    except ValueError:
+        flash('That page link is no longer valid.', 'danger')
+        return redirect(url_for('transactions', per_page=per_page, search_query=search_query))
 
+    app_settings = settings_manager.get_settings()
+    regions = requested_live_regions()
+    live_context = dict(transactions=page_transactions, balances=balances, search_query=search_query,
+                        category_icons=app_settings['category_icons'],
+                        income_category_icons=app_settings['income_category_icons'])
+    if not regions or 'transactions-count' in regions:
+        live_context.update(total_transactions=None if search_query else budget_logic.count_transactions(),
+                            archived_transactions=archive.archived_summary()[0])
+    if regions:
+        return render_live_regions('transactions.html', regions, **live_context)
+
+    return render_template('transactions.html',
+                           categories=app_settings['expense_categories'],
+                           income_categories=app_settings['income_categories'],
+                           savings_goals=savings_goals_logic.get_savings_goals(),
+                           per_page=per_page, older_cursor=older_cursor, newer_cursor=newer_cursor,
+                           **live_context)
+
+
+def add_monthly_budget(report_data, app_settings):
+    """Adds the monthly budget figures (budget, savings goal, remaining to spend) to a monthly report."""
+    if report_data['period'] == 'monthly':
+        report_data['total_budget'] = report_data['total_income']
+        report_data['savings_goal'] = app_settings.get('monthly_savings_goal', 0)
+        report_data['remaining_spending'] = report_data['total_budget'] - report_data['savings_goal'] - report_data['total_expense']
 
 @app.route('/report')
 @login_required
+@query_budget(REPORT_QUERY_SECONDS, heavy=True)
 def report():
-    # ... (code remains the same for now)
     period = request.args.get('period')
     start_date_str = request.args.get('start_date')
     end_date_str = request.args.get('end_date')
-    report_data = budget_logic.generate_report_data(period=period, start_date_str=start_date_str, end_date_str=end_date_str)
-    # ... (rest of the function)
+    search_query = request.args.get('search_query', '').strip()
+    per_page = request.args.get('per_page', 10, type=int)
+    compare = request.args.get('compare') == '1'
+    items_by = 'count' if request.args.get('items_by') == 'count' else 'total'
+
+    # Aggregates only: the transaction list is fetched separately by report_transactions()
+    report_data = budget_logic.generate_report_data(period=period, start_date_str=start_date_str, end_date_str=end_date_str,
+                                                    include_transactions=False)
+    comparison = None
+    if compare:
+        comparison = budget_logic.generate_comparison_data(period=period, start_date_str=start_date_str,
+                                                           end_date_str=end_date_str)
     app_settings = settings_manager.get_settings()
     current_category_icons = app_settings['category_icons']
     income_category_icons = app_settings['income_category_icons']
-    return render_template('report.html', report=report_data, current_period=period, category_icons=current_category_icons, income_category_icons=income_category_icons, start_date=report_data['start_date'], end_date=report_data['end_date'])
+
+    displayed_total_expense = report_data['total_expense']
+    add_monthly_budget(report_data, app_settings)
+
+    savings_goals = savings_goals_logic.get_savings_goals()
+    cash_flow_forecast = forecast.get_forecast(savings_goals, app_settings.get('monthly_savings_goal', 0))
+    live_context = dict(report=report_data, current_period=period,
+                        category_icons=current_category_icons, income_category_icons=income_category_icons,
+                        start_date=report_data['start_date'], end_date=report_data['end_date'],
+                        displayed_total_expense=displayed_total_expense,
+                        savings_goals=savings_goals, forecast=cash_flow_forecast,
+                        compare=compare, comparison=comparison)
+    regions = requested_live_regions()
+    if regions:
+        return render_live_regions('report.html', regions, **live_context)
+
+    # The top items table is not a live region, so it is only queried for the full page
+    top_items = budget_logic.get_top_items(period=period, start_date_str=start_date_str, end_date_str=end_date_str,
+                                           limit=TOP_ITEMS, order=items_by)
+    return render_template('report.html', search_query=search_query, per_page=per_page,
+                           top_items=top_items, items_by=items_by, **live_context)
+
+@app.route('/report/pdf')
+@login_required
+@query_budget(EXPORT_QUERY_SECONDS, heavy=True)
+def report_pdf_download():
+    """The report as a PDF built on the server, cached per (range, data generation)."""
+    period = request.args.get('period')
+    start_date_str = request.args.get('start_date')
+    end_date_str = request.args.get('end_date')
+    compare = request.args.get('compare') == '1'
+    app_settings = settings_manager.get_settings()
+
+    # The cache key's generation and the report rows must come from the same server
+    db.pin_reads_to_primary()
+    generation, _ = budget_logic.get_data_generation()
+    # Today is part of the key because the default ranges (this month, this year) move with it
+    key = (period, start_date_str, end_date_str, compare, date.today().isoformat(), generation,
+           app_settings.get('monthly_savings_goal', 0))
+
+    pdf = report_pdf.get_cached_pdf(key)
+    if pdf is None:
+        report_data = budget_logic.generate_report_data(period=period, start_date_str=start_date_str,
+                                                        end_date_str=end_date_str, include_transactions=True)
+        add_monthly_budget(report_data, app_settings)
+        if compare:
+            report_data['comparison'] = budget_logic.generate_comparison_data(
+                period=period, start_date_str=start_date_str, end_date_str=end_date_str)
+        pdf = report_pdf.render_report_pdf(report_data)
+        report_pdf.cache_pdf(key, pdf)
+
+    response = app.response_class(pdf, mimetype='application/pdf')
+    response.headers['Content-Disposition'] = 'attachment; filename="budget_report.pdf"'
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.set_etag(hashlib.sha256(repr(key).encode()).hexdigest()[:32])
+    return response.make_conditional(request)
+
+@app.route('/report/transactions')
+@login_required
+@query_budget(PAGE_QUERY_SECONDS)
+def report_transactions():
+    """One keyset page of a report's transactions, rendered as table rows for report.html to append."""
+    per_page = min(max(request.args.get('per_page', 10, type=int), 1), API_MAX_LIMIT)
+    cursor = request.args.get('cursor')
+    filters = {
+        'start_date': request.args.get('start_date'),
+        'end_date': request.args.get('end_date'),
+        'search': request.args.get('search_query', '').strip(),
+    }
+    try:
+        rows, balances, next_cursor, _ = budget_logic.get_ledger_page(limit=per_page, cursor=cursor, filters=filters)
+    except ValueError:
+        return '', 400
+
+    next_url = None
+    if next_cursor:
+        next_url = url_for('report_transactions', cursor=next_cursor, per_page=per_page,
+                           start_date=filters['start_date'], end_date=filters['end_date'],
+                           search_query=filters['search'])
+    app_settings = settings_manager.get_settings()
+    return render_template('report_transactions.html', transactions=rows, balances=balances, cursor=cursor, next_url=next_url,
+                           category_icons=app_settings['category_icons'],
+                           income_category_icons=app_settings['income_category_icons'])
+
+@app.route('/trends')
+@login_required
+@query_budget(REPORT_QUERY_SECONDS, heavy=True)
+def trends():
+    today = datetime.now().date()
+    months = min(max(request.args.get('months', 12, type=int), 1), 240)
+    window = min(max(request.args.get('window', 3, type=int), 1), 24)
+
+    # First day of the month `months - 1` months back, through today
+    first_month = analytics.month_index(today.year, today.month) - (months - 1)
+    start_date = analytics.month_label(first_month) + '-01'
+    end_date = today.isoformat()
+
+    snapshot = analytics.get_snapshot()
+    by_category = snapshot.monthly_by_category(start_date, end_date, transaction_type='expense')
+    totals = snapshot.monthly_totals(start_date, end_date)
+    totals['expense_rolling'] = analytics.rolling_mean(totals['expense'], window)
+
+    return render_template('trends.html', by_category=by_category, totals=totals,
+                           months=months, window=window, start_date=start_date, end_date=end_date)
+
+@app.route('/events')
+@login_required
+def events():
+    """Server-Sent Events stream of data changes; pages use it to patch themselves in place."""
+    try:
+        subscription = changefeed.feed.subscribe()
+    except changefeed.TooManyStreams:
+        # live.js tries again later; until then the page just doesn't update itself
+        return 'Too many open event streams', 503, {'Retry-After': str(changefeed.HEARTBEAT_SECONDS * 2)}
+
+    def stream():
+        try:
+            yield 'retry: 3000\n\n'
+            deadline = time.monotonic() + changefeed.STREAM_SECONDS
+            while time.monotonic() < deadline:
+                event = changefeed.feed.next_event(subscription, changefeed.HEARTBEAT_SECONDS)
+                yield changefeed.format_sse(event) if event else ': keep-alive\n\n'
+        finally:
+            changefeed.feed.unsubscribe(subscription)
+
+    response = app.response_class(stream(), mimetype='text/event-stream',
+                                  headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # A client gone before the first chunk never runs the generator's finally, but the response is still closed
+    response.call_on_close(lambda: changefeed.feed.unsubscribe(subscription))
+    return response
 
 @app.route('/settings', methods=['GET', 'POST'])
 @login_required
@@ -489,22 +1020,233 @@ def manage_categories():
                            category_icons=category_icons,
                            current_settings=current_settings)
 
+@app.route('/settings/savings_goals', methods=['GET', 'POST'], endpoint='manage_savings_goals')
+@login_required
+def manage_savings_goals():
+    current_savings_goals = savings_goals_logic.get_savings_goals()
+
+    if request.method == 'POST':
+        new_goal_name = request.form.get('new_goal_name', '').strip()
+        new_goal_target = float(request.form.get('new_goal_target', 0))
+
+        if new_goal_name and new_goal_target > 0:
+            savings_goals_logic.add_savings_goal(new_goal_name, new_goal_target)
+            flash(f'Savings Goal "{new_goal_name}" added successfully!', 'success')
+        else:
+            flash('Goal name and target amount cannot be empty or zero.', 'danger')
+
+        return redirect(url_for('manage_savings_goals'))
+
+    goal_forecast = forecast.get_forecast(current_savings_goals,
+                                          settings_manager.get_settings().get('monthly_savings_goal', 0))
+    return render_template('savings_goals.html', savings_goals=current_savings_goals, forecast=goal_forecast)
+
+@app.route('/settings/savings_goals/delete/<goal_id>', endpoint='delete_savings_goal')
+@login_required
+def delete_savings_goal(goal_id):
+    savings_goals_logic.delete_savings_goal(goal_id)
+    flash('Savings Goal deleted successfully.', 'success')
+    return redirect(url_for('manage_savings_goals'))
+
+@app.route('/settings/savings_goals/edit/<goal_id>', methods=['GET', 'POST'], endpoint='edit_savings_goal')
+@login_required
+def edit_savings_goal(goal_id):
+    goal = savings_goals_logic.get_savings_goal(goal_id)
+    if not goal:
+        flash('Savings Goal not found.', 'danger')
+        return redirect(url_for('manage_savings_goals'))
+
+    if request.method == 'POST':
+        new_goal_name = request.form.get('new_goal_name', '').strip()
+        new_goal_target = float(request.form.get('new_goal_target', 0))
+
+        if not new_goal_name or new_goal_target <= 0:
+            flash('Goal name and target amount cannot be empty or zero.', 'danger')
+            return redirect(url_for('edit_savings_goal', goal_id=goal_id))
+
+        savings_goals_logic.update_savings_goal(goal_id, new_goal_name, new_goal_target)
+        flash(f'Savings Goal "{new_goal_name}" updated successfully!', 'success')
+        return redirect(url_for('manage_savings_goals'))
+
+    return render_template('edit_savings_goal.html', goal=goal)
+
+@app.route('/settings/recurring', methods=['GET', 'POST'])
+@login_required
+def manage_recurring():
+    app_settings = settings_manager.get_settings()
+    savings_goals = savings_goals_logic.get_savings_goals()
+
+    if request.method == 'POST':
+        cadence = request.form.get('cadence')
+        end_date = request.form.get('end_date', '').strip() or None
+        rows, errors = budget_logic.validate_transaction_rows([request.form.to_dict()], app_settings,
+                                                              [goal['id'] for goal in savings_goals])
+        if cadence not in recurring.CADENCES:
+            errors.append('Please choose how often the transaction repeats.')
+        if not errors and end_date:
+            try:
+                if datetime.strptime(end_date, '%Y-%m-%d').strftime('%Y-%m-%d') < rows[0]['date']:
+                    errors.append('The end date must not be before the start date.')
+            except ValueError:
+                errors.append('End date must be in YYYY-MM-DD format.')
+        if errors:
+            flash_single_row_errors(errors)
+            return redirect(url_for('manage_recurring'))
+
+        recurring.add_rule(rows[0], cadence, end_date)
+        # A start date in the past is backfilled right away rather than on the next scheduler tick
+        created = recurring.materialize_due()
+        flash(f'Recurring {rows[0]["type"]} "{rows[0]["item"]}" added; {created} transactions created so far.', 'success')
+        return redirect(url_for('manage_recurring'))
+
+    return render_template('recurring.html',
+                           rules=recurring.get_rules(),
+                           cadences=recurring.CADENCES,
+                           categories=app_settings['expense_categories'],
+                           income_categories=app_settings['income_categories'],
+                           savings_goals=savings_goals,
+                           today_date=datetime.now().strftime('%Y-%m-%d'))
+
+@app.route('/settings/recurring/<int:rule_id>/pause', methods=['POST'])
+@login_required
+def pause_recurring(rule_id):
+    recurring.set_rule_active(rule_id, False)
+    flash('Recurring transaction paused.', 'success')
+    return redirect(url_for('manage_recurring'))
+
+@app.route('/settings/recurring/<int:rule_id>/resume', methods=['POST'])
+@login_required
+def resume_recurring(rule_id):
+    recurring.set_rule_active(rule_id, True)
+    flash('Recurring transaction resumed.', 'success')
+    return redirect(url_for('manage_recurring'))
+
+@app.route('/settings/recurring/<int:rule_id>/delete', methods=['POST'])
+@login_required
+def delete_recurring(rule_id):
+    recurring.delete_rule(rule_id)
+    flash('Recurring transaction deleted. The transactions it already created were kept.', 'success')
+    return redirect(url_for('manage_recurring'))
+
+def parse_transaction_ids(values):
+    """Turns submitted transaction id strings into a de-duplicated list of ints, ignoring junk."""
+    ids = []
+    for value in values:
+        try:
+            ids.append(int(value))
+        except (TypeError, ValueError):
+            continue
+    return list(dict.fromkeys(ids))
+
+def reverse_goal_contributions(deleted_transactions):
+    increments = savings_goals_logic.aggregate_goal_increments(deleted_transactions)
+    savings_goals_logic.apply_saved_amount_increments({goal_id: -amount for goal_id, amount in increments.items()})
+
 @app.route('/delete/<transaction_id>')
 @login_required
 def delete(transaction_id):
-    budget_logic.delete_transaction(transaction_id)
+    deleted = budget_logic.bulk_delete_transactions(parse_transaction_ids([transaction_id]))
+    reverse_goal_contributions(deleted)
     return redirect(request.referrer or url_for('index'))
 
+@app.route('/transactions/bulk', methods=['POST'])
+@login_required
+def bulk_transactions():
+    transaction_ids = parse_transaction_ids(request.form.getlist('transaction_ids'))
+    action = request.form.get('action')
+    redirect_to = request.referrer or url_for('transactions')
+
+    if not transaction_ids:
+        flash('Select at least one transaction.', 'warning')
+        return redirect(redirect_to)
+
+    if action == 'delete':
+        deleted = budget_logic.bulk_delete_transactions(transaction_ids)
+        reverse_goal_contributions(deleted)
+        flash(f'{len(deleted)} transactions deleted.', 'success')
+
+    elif action == 'redate':
+        date = request.form.get('date', '').strip()
+        try:
+            datetime.strptime(date, '%Y-%m-%d')
+        except ValueError:
+            flash('Please choose a valid date.', 'danger')
+            return redirect(redirect_to)
+        old_rows, _ = budget_logic.bulk_update_transactions(transaction_ids, {'date': date})
+        flash(f'{len(old_rows)} transactions moved to {date}.', 'success')
+
+    elif action == 'recategorize':
+        # Values look like "expense:Food" so one select can offer both category lists
+        transaction_type, _, category = request.form.get('category', '').partition(':')
+        app_settings = settings_manager.get_settings()
+        valid_categories = {
+            'income': app_settings['income_categories'],
+            'expense': app_settings['expense_categories'],
+        }
+        if category not in valid_categories.get(transaction_type, ()):
+            flash('Please choose a valid category.', 'danger')
+            return redirect(redirect_to)
+
+        savings_goal_id = None
+        if transaction_type == 'expense' and category == 'Goal Savings':
+            goal_id = request.form.get('savings_goal_id', '')
+            if not savings_goals_logic.get_savings_goal(goal_id):
+                flash('Please select a savings goal for "Goal Savings" category.', 'danger')
+                return redirect(redirect_to)
+            savings_goal_id = int(goal_id)
+
+        old_rows, new_rows = budget_logic.bulk_update_transactions(
+            transaction_ids,
+            {'category': category, 'savings_goal_id': savings_goal_id},
+            only_type=transaction_type
+        )
+        savings_goals_logic.apply_saved_amount_increments(
+            savings_goals_logic.diff_goal_increments(old_rows, new_rows)
+        )
+        # Rows of the other type can't take this category, so they are left alone
+        skipped = len(transaction_ids) - len(new_rows)
+        message = f'{len(new_rows)} transactions moved to {category}.'
+        if skipped:
+            message += f' {skipped} selected transactions were skipped because they are not {transaction_type} transactions.'
+        flash(message, 'success')
+
+    else:
+        flash('Unknown bulk action.', 'danger')
+
+    return redirect(redirect_to)
+
 
 @app.route('/edit/<transaction_id>', methods=['GET', 'POST'])
 @login_required
 def edit(transaction_id):
-    # ... (code remains the same for now)
     transaction = budget_logic.get_transaction(transaction_id)
+    if transaction is None:
+        flash('Transaction not found.', 'danger')
+        return redirect(url_for('transactions'))
+
+    app_settings = settings_manager.get_settings()
+    savings_goals = savings_goals_logic.get_savings_goals()
+
     if request.method == 'POST':
-        #...
-        pass
-    return render_template('edit.html', transaction=transaction)
+        clean_rows, errors = budget_logic.validate_transaction_rows(
+            [request.form.to_dict()], app_settings, [goal['id'] for goal in savings_goals]
+        )
+        if errors:
+            flash_single_row_errors(errors)
+            return redirect(url_for('edit', transaction_id=transaction_id))
+
+        updated = clean_rows[0]
+        budget_logic.update_transaction(transaction_id, dict(updated))
+        savings_goals_logic.apply_saved_amount_increments(
+            savings_goals_logic.diff_goal_increments([transaction], [updated])
+        )
+        flash('Transaction updated.', 'success')
+        return redirect(url_for('transactions'))
+
+    return render_template('edit.html', transaction=transaction,
+                           categories=app_settings['expense_categories'],
+                           income_categories=app_settings['income_categories'],
+                           savings_goals=savings_goals)
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', debug=True)
@@ -0,0 +1,281 @@
+import argparse
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+import budget
+import db
+
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', os.path.join(os.path.abspath(os.path.dirname(__file__)), 'archive'))
+# Months that ended at least this many months ago are archived by default
+ARCHIVE_AFTER_MONTHS = int(os.environ.get('ARCHIVE_AFTER_MONTHS', 24))
+MANIFEST_FILE = 'manifest.json'
+SAVINGS_CATEGORIES = ('Goal Savings', 'General Savings')
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def add_months(month, count):
+    """The first day of the month `count` months after the month of `month`."""
+    year, index = divmod(month.year * 12 + month.month - 1 + count, 12)
+    return date(year, index + 1, 1)
+
+
+def default_cutoff(today=None):
+    """Rows dated before this are archived when no cutoff is given."""
+    return add_months(today or date.today(), -ARCHIVE_AFTER_MONTHS)
+
+
+def _chunk_path(file):
+    return os.path.join(ARCHIVE_DIR, file)
+
+
+def _write_chunk(file, rows):
+    """
+    Writes rows (in TRANSACTION_COLUMNS order) as a gzip'd CSV chunk and returns its sha256.
+    The file is synced to disk before returning, since the caller deletes the rows from Postgres next.
+    """
+    path = _chunk_path(file)
+    with open(path + '.tmp', 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=9, mtime=0) as compressed:
+            text = io.TextIOWrapper(compressed, encoding='utf-8', newline='')
+            writer = csv.writer(text)
+            writer.writerow(budget.TRANSACTION_COLUMNS)
+            writer.writerows(['' if value is None else value for value in row] for row in rows)
+            text.flush()
+            text.detach()
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(path + '.tmp', path)
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def read_chunk(file):
+    """Yields the Transactions stored in one chunk file, oldest first."""
+    with gzip.open(_chunk_path(file), 'rt', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        next(reader)  # header
+        for transaction_id, row_date, row_type, category, item, amount, description, savings_goal_id in reader:
+            yield budget.Transaction(
+                int(transaction_id), date.fromisoformat(row_date), row_type, category, item, Decimal(amount),
+                description, int(savings_goal_id) if savings_goal_id else None
+            )
+
+
+def archive_month(month):
+    """
+    Moves the transactions dated in `month` into a new chunk file, and their totals into archived_totals,
+    in one database transaction. Rows added to the month later stay hot until the month is archived again,
+    which writes another chunk. Returns the number of rows moved.
+    """
+    conn = db.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            # The row locks keep these rows from changing between writing the file and deleting them
+            cur.execute(
+                "SELECT transaction_id, date, type, category, item, amount, description, savings_goal_id "
+                "FROM transactions WHERE date >= %s AND date < %s ORDER BY date, transaction_id FOR UPDATE;",
+                (month, add_months(month, 1))
+            )
+            rows = cur.fetchall()
+            if not rows:
+                conn.rollback()
+                return 0
+            ids = [row[0] for row in rows]
+            file = f'transactions-{month:%Y-%m}-{min(ids)}-{max(ids)}.csv.gz'
+            sha256 = _write_chunk(file, rows)
+
+            cur.execute("""
+                WITH moved AS (
+                    DELETE FROM transactions WHERE transaction_id = ANY(%s) RETURNING *
+                )
+                INSERT INTO archived_totals (month, type, category, item, savings_goal_id, total, transaction_count,
+                                             first_date, last_date)
+                SELECT date_trunc('month', date)::date, type, category, item, COALESCE(savings_goal_id, 0), SUM(amount), COUNT(*),
+                       MIN(date), MAX(date)
+                FROM moved
+                GROUP BY 1, 2, 3, 4, 5
+                ON CONFLICT (month, type, category, item, savings_goal_id) DO UPDATE SET
+                    total = archived_totals.total + EXCLUDED.total,
+                    transaction_count = archived_totals.transaction_count + EXCLUDED.transaction_count,
+                    first_date = LEAST(archived_totals.first_date, EXCLUDED.first_date),
+                    last_date = GREATEST(archived_totals.last_date, EXCLUDED.last_date);
+            """, (ids,))
+            cur.execute(
+                "INSERT INTO archive_chunks (file, month, row_count, sha256) VALUES (%s, %s, %s, %s);",
+                (file, month, len(rows), sha256)
+            )
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db.release_db_connection(conn)
+    return len(rows)
+
+
+def write_manifest():
+    """Rewrites manifest.json from archive_chunks, so the archive directory describes itself."""
+    conn = db.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT file, month, row_count, sha256, archived_at FROM archive_chunks ORDER BY month, file;")
+            chunks = [
+                {'file': file, 'month': f'{month:%Y-%m}', 'rows': row_count, 'sha256': sha256,
+                 'archived_at': archived_at.isoformat(timespec='seconds')}
+                for file, month, row_count, sha256, archived_at in cur.fetchall()
+            ]
+    finally:
+        db.release_db_connection(conn)
+    manifest = {'format': 'csv.gz', 'columns': list(budget.TRANSACTION_COLUMNS), 'chunks': chunks}
+    path = os.path.join(ARCHIVE_DIR, MANIFEST_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def archive_before(cutoff):
+    """Archives every month that ends on or before `cutoff` (rounded down to a month). Returns [(month, rows)]."""
+    cutoff = month_start(cutoff)
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    conn = db.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT DISTINCT date_trunc('month', date)::date FROM transactions WHERE date < %s ORDER BY 1;",
+                (cutoff,)
+            )
+            months = [row[0] for row in cur.fetchall()]
+    finally:
+        db.release_db_connection(conn)
+
+    archived = [(month, archive_month(month)) for month in months]
+    write_manifest()
+    return archived
+
+
+# Every report looks up its archived chunks first, usually finding none
+db.register_statement(
+    'archive_chunks_in_range',
+    "SELECT file, month FROM archive_chunks WHERE month >= %s AND month < %s ORDER BY month, file;"
+)
+
+
+def _chunks_overlapping(cur, start_date, end_date):
+    db.execute_statement(cur, 'archive_chunks_in_range', (month_start(start_date), end_date))
+    return cur.fetchall()
+
+
+def has_chunks(cur, start_date, end_date):
+    """Whether any archived chunk can hold transactions dated in [start_date, end_date)."""
+    return bool(_chunks_overlapping(cur, start_date, end_date))
+
+
+def iter_transactions(cur, start_date, end_date):
+    """Streams archived Transactions dated in [start_date, end_date), reading only the chunks that overlap it."""
+    for file, _ in _chunks_overlapping(cur, start_date, end_date):
+        for transaction in read_chunk(file):
+            if start_date <= transaction.date < end_date:
+                yield transaction
+
+
+db.register_statement('archived_summary', "SELECT COALESCE(SUM(transaction_count), 0), MAX(month) FROM archived_totals;")
+db.register_statement(
+    'archived_goal_savings',
+    "SELECT savings_goal_id, SUM(total) FROM archived_totals "
+    "WHERE type = 'expense' AND category = 'Goal Savings' AND savings_goal_id <> 0 GROUP BY savings_goal_id;"
+)
+
+
+def archived_summary():
+    """(number of archived transactions, first day of the last archived month or None)."""
+    conn = db.get_read_connection()
+    try:
+        with conn.cursor() as cur:
+            db.execute_statement(cur, 'archived_summary')
+            count, last_month = cur.fetchone()
+    finally:
+        db.release_db_connection(conn)
+    return int(count), last_month
+
+
+def goal_savings_totals():
+    """{savings goal id: amount} saved towards each goal by archived 'Goal Savings' expenses."""
+    conn = db.get_read_connection()
+    try:
+        with conn.cursor() as cur:
+            db.execute_statement(cur, 'archived_goal_savings')
+            return dict(cur.fetchall())
+    finally:
+        db.release_db_connection(conn)
+
+
+def summarize_range(cur, start_date, end_date):
+    """
+    Totals of the archived transactions dated in [start_date, end_date), or None if none of it is archived.
+    Whole months come from archived_totals; the chunks of a partly covered first or last month are read.
+    Returns {'totals': {(type, category): amount}, 'income_items': {item: amount},
+             'items': {(type, category, item): amount},
+             'months': {('YYYY-MM', type): [amount, savings amount]}, 'transaction_count': n}.
+    """
+    chunks = _chunks_overlapping(cur, start_date, end_date)
+    if not chunks:
+        return None
+
+    totals = defaultdict(Decimal)
+    income_items = defaultdict(Decimal)
+    items = defaultdict(Decimal)
+    months = defaultdict(lambda: [Decimal(0), Decimal(0)])
+    transaction_count = 0
+
+    def add(month, row_type, category, item, amount):
+        totals[(row_type, category)] += amount
+        if row_type == 'income':
+            income_items[item] += amount
+        items[(row_type, category, item)] += amount
+        month_totals = months[(f'{month:%Y-%m}', row_type)]
+        month_totals[0] += amount
+        if category in SAVINGS_CATEGORIES:
+            month_totals[1] += amount
+
+    first_full_month = start_date if start_date.day == 1 else add_months(start_date, 1)
+    end_of_full_months = month_start(end_date)
+    cur.execute(
+        "SELECT month, type, category, item, SUM(total), SUM(transaction_count) FROM archived_totals "
+        "WHERE month >= %s AND month < %s GROUP BY 1, 2, 3, 4;",
+        (first_full_month, end_of_full_months)
+    )
+    for month, row_type, category, item, amount, count in cur.fetchall():
+        add(month, row_type, category, item, amount)
+        transaction_count += count
+
+    for file, month in chunks:
+        if first_full_month <= month < end_of_full_months:
+            continue
+        for transaction in read_chunk(file):
+            if start_date <= transaction.date < end_date:
+                add(month, transaction.type, transaction.category, transaction.item, transaction.amount)
+                transaction_count += 1
+
+    return {'totals': totals, 'income_items': income_items, 'items': items, 'months': months,
+            'transaction_count': transaction_count}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Move transactions of closed months into compressed archive files.')
+    parser.add_argument('--before', type=date.fromisoformat, default=None,
+                        help=f'archive months before this date (default: {ARCHIVE_AFTER_MONTHS} months ago)')
+    args = parser.parse_args()
+    cutoff = args.before or default_cutoff()
+    moved = archive_before(cutoff)
+    for month, rows in moved:
+        print(f"Archived {rows} transactions from {month:%Y-%m}")
+    print(f"Archived {sum(rows for _, rows in moved)} transactions dated before {month_start(cutoff)} into {ARCHIVE_DIR}")
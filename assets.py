@@ -0,0 +1,123 @@
+import gzip
+import hashlib
+import os
+import threading
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # gzip alone still works; brotli just squeezes text a little further
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'static')
+VENDOR_DIR = 'vendor'
+
+# Third-party files the templates use: file under static/vendor/ -> pinned CDN URL.
+# vendor_assets.py downloads them (and the fonts their CSS loads); until it has run, asset_url()
+# falls back to the CDN.
+VENDOR_ASSETS = {
+    'bootstrap.bundle.min.js': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js',
+    'chart.umd.js': 'https://cdn.jsdelivr.net/npm/chart.js@4.4.1/dist/chart.umd.js',
+    'chartjs-plugin-datalabels.min.js': 'https://cdn.jsdelivr.net/npm/chartjs-plugin-datalabels@2.0.0/dist/chartjs-plugin-datalabels.min.js',
+    'bootswatch-cerulean.min.css': 'https://cdn.jsdelivr.net/npm/bootswatch@5.3.0/dist/cerulean/bootstrap.min.css',
+    'bootswatch-flatly.min.css': 'https://cdn.jsdelivr.net/npm/bootswatch@5.3.0/dist/flatly/bootstrap.min.css',
+    'bootswatch-vapor.min.css': 'https://cdn.jsdelivr.net/npm/bootswatch@5.3.0/dist/vapor/bootstrap.min.css',
+    'fontawesome.all.min.css': 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.5.2/css/all.min.css',
+}
+# sha256 of every vendored file, written by vendor_assets.py and checked by it on later runs
+VENDOR_CHECKSUMS = 'SHA256SUMS'
+
+# Responses smaller than this aren't worth the CPU or the Content-Encoding header
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+COMPRESSIBLE_MIMETYPES = {'text/html', 'application/json', 'text/css', 'application/javascript', 'text/javascript', 'text/plain'}
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 5
+# Hashed assets are compressed once and kept, so they can afford the slowest settings
+ASSET_GZIP_LEVEL = 9
+ASSET_BROTLI_QUALITY = 11
+
+_digests = {}        # filename -> (mtime, digest)
+_asset_bodies = {}   # (filename, digest, requested encoding) -> (body, encoding used)
+_lock = threading.Lock()
+
+
+def choose_encoding(accept_encodings):
+    """'br' or 'gzip' as the client accepts them (br preferred when available), else None."""
+    if brotli is not None and 'br' in accept_encodings:
+        return 'br'
+    if 'gzip' in accept_encodings:
+        return 'gzip'
+    return None
+
+
+def compress(body, encoding, level=None):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY if level is None else level)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL if level is None else level)
+
+
+def _digest(filename):
+    """Short content hash of a file under static/, or None if it doesn't exist."""
+    path = safe_join(STATIC_DIR, filename)
+    if path is None:
+        return None
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    cached = _digests.get(filename)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:12]
+    _digests[filename] = (mtime, digest)
+    return digest
+
+
+def hashed_name(filename):
+    """'vendor/chart.umd.js' -> 'vendor/chart.umd.<hash>.js', or None if the file is missing."""
+    digest = _digest(filename)
+    if digest is None:
+        return None
+    stem, dot, extension = filename.rpartition('.')
+    return f'{stem}.{digest}.{extension}' if dot else f'{filename}.{digest}'
+
+
+def split_hashed_name(name):
+    """Inverse of hashed_name(): returns (filename, digest), or (None, None) if it isn't one."""
+    stem, dot, extension = name.rpartition('.')
+    if not dot:
+        return None, None
+    base, dot, digest = stem.rpartition('.')
+    if not dot:
+        # No extension: the digest is the last part
+        return stem, extension
+    return f'{base}.{extension}', digest
+
+
+def cdn_url(filename):
+    """The CDN fallback for a vendored library, or None for the app's own files."""
+    directory, _, name = filename.rpartition('/')
+    return VENDOR_ASSETS.get(name) if directory == VENDOR_DIR else None
+
+
+def load_asset(name, encoding):
+    """
+    Body for a hashed asset URL, compressed with `encoding` when given and worthwhile.
+    Returns (body, encoding actually used), or (None, None) if the name or hash doesn't match a file.
+    """
+    filename, digest = split_hashed_name(name)
+    if filename is None or _digest(filename) != digest:
+        return None, None
+    key = (filename, digest, encoding)
+    cached = _asset_bodies.get(key)
+    if cached is None:
+        with open(safe_join(STATIC_DIR, filename), 'rb') as f:
+            body = f.read()
+        used = encoding if encoding and len(body) >= COMPRESS_MIN_BYTES else None
+        if used:
+            body = compress(body, used, ASSET_BROTLI_QUALITY if used == 'br' else ASSET_GZIP_LEVEL)
+        cached = (body, used)
+        with _lock:
+            _asset_bodies[key] = cached
+    return cached
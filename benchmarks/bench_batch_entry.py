@@ -0,0 +1,79 @@
+"""
+Compares single-row transaction entry (one POST to / per row) against batch entry.
+
+Runs against the database in DATABASE_URL. Rows are tagged and deleted afterwards.
+
+    DATABASE_URL=postgres://... python benchmarks/bench_batch_entry.py [rows]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import budget
+import db
+import savings_goals
+import settings_manager
+
+BENCH_TAG = '__bench_batch_entry__'
+
+
+def make_rows(count):
+    return [
+        {
+            'type': 'expense', 'category': 'Food', 'item': f'Receipt {i}', 'amount': f'{(i % 50) + 1}.25',
+            'date': '2025-01-%02d' % ((i % 28) + 1), 'description': BENCH_TAG, 'savings_goal_id': '',
+        }
+        for i in range(count)
+    ]
+
+
+def single_row_entry(rows):
+    # Mirrors the work index() does for each POST
+    for row in rows:
+        app_settings = settings_manager.get_settings()
+        savings_goals.get_savings_goals()
+        if row['category'] in app_settings['expense_categories']:
+            budget.add_transaction(row['type'], row['category'], row['item'], float(row['amount']),
+                                   row['date'], row['description'], '')
+
+
+def batch_entry(rows):
+    app_settings = settings_manager.get_settings()
+    goal_ids = [goal['id'] for goal in savings_goals.get_savings_goals()]
+    clean_rows, errors = budget.validate_transaction_rows(rows, app_settings, goal_ids)
+    assert not errors, errors
+    budget.add_transactions(clean_rows)
+
+
+def cleanup():
+    conn = db.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM transactions WHERE description = %s;", (BENCH_TAG,))
+            conn.commit()
+    finally:
+        db.release_db_connection(conn)
+
+
+def timed(label, func, rows):
+    started = time.perf_counter()
+    func(rows)
+    elapsed = time.perf_counter() - started
+    print(f'{label:<20} {len(rows):>7} rows  {elapsed:8.3f}s  {len(rows) / elapsed:12.1f} rows/s')
+    cleanup()
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    db.init_db()
+    rows = make_rows(count)
+    single = timed('single-row entry', single_row_entry, rows)
+    batch = timed('batch entry', batch_entry, rows)
+    print(f'speedup: {single / batch:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
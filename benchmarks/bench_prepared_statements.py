@@ -0,0 +1,118 @@
+"""
+Compares the hot query set run as plain statements against the same statements run through the
+prepared statement registry (db.execute_statement()), from several concurrent connections.
+
+Runs read-only against the database in DATABASE_URL. Also prints each statement's planning time,
+which the prepared runs stop paying once Postgres switches them to a cached generic plan.
+
+    DATABASE_URL=postgres://... python benchmarks/bench_prepared_statements.py [workers] [rounds]
+"""
+import os
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import budget
+import db
+import psycopg2
+import settings_manager
+
+
+def hot_set():
+    """(statement name, params) for one page view's worth of the hot statements."""
+    today = date.today()
+    month = today.replace(day=1)
+    next_month = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+    year = (date(today.year, 1, 1), date(today.year + 1, 1, 1))
+    first_page = (*budget.OPEN_DATE_RANGE, *budget.FIRST_PAGE_CURSOR[False], 51)
+    return [(name, ()) for name in settings_manager.STATEMENTS] + [
+        ('ledger_balances_older', first_page),
+        ('report_totals', (month, next_month)),
+        ('report_income_by_item', (month, next_month)),
+        ('report_months', year),
+    ]
+
+
+def plain_text(name):
+    # The registry keeps the $n form; turn it back into a %s query for cursor.execute()
+    return re.sub(r'\$\d+', '%s', db.registered_statements()[name].replace('%', '%%'))
+
+
+def run_plain(cur, name, params):
+    cur.execute(plain_text(name), params)
+
+
+def run_prepared(cur, name, params):
+    db.execute_statement(cur, name, params)
+
+
+def worker(run, statements, rounds, timings, barrier):
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            barrier.wait()
+            for _ in range(rounds):
+                for name, params in statements:
+                    started = time.perf_counter()
+                    run(cur, name, params)
+                    cur.fetchall()
+                    timings[name].append(time.perf_counter() - started)
+    finally:
+        conn.close()
+
+
+def measure(label, run, statements, workers, rounds):
+    timings = defaultdict(list)
+    barrier = threading.Barrier(workers + 1)
+    threads = [threading.Thread(target=worker, args=(run, statements, rounds, timings, barrier)) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    total = sum(len(samples) for samples in timings.values())
+    print(f'{label:<10} {total / elapsed:10.0f} statements/s over {workers} connections')
+    return {name: sum(samples) / len(samples) for name, samples in timings.items()}
+
+
+def planning_ms(statements):
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        with conn.cursor() as cur:
+            result = {}
+            for name, params in statements:
+                cur.execute('EXPLAIN (SUMMARY ON) ' + plain_text(name), params)
+                plan = '\n'.join(row[0] for row in cur.fetchall())
+                result[name] = float(re.search(r'Planning Time: ([\d.]+) ms', plan).group(1))
+            return result
+    finally:
+        conn.close()
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    statements = hot_set()
+
+    # Warm the caches, so neither run pays for reading the tables from disk
+    measure('warm-up', run_plain, statements, workers, 5)
+    plain = measure('plain', run_plain, statements, workers, rounds)
+    prepared = measure('prepared', run_prepared, statements, workers, rounds)
+    planning = planning_ms(statements)
+
+    print(f"\n{'statement':<32} {'plan ms':>8} {'plain µs':>10} {'prepared µs':>12} {'saved':>7}")
+    for name, _ in statements:
+        saved = 1 - prepared[name] / plain[name]
+        print(f'{name:<32} {planning[name]:8.3f} {plain[name] * 1e6:10.0f} {prepared[name] * 1e6:12.0f} {saved:7.0%}')
+
+
+if __name__ == '__main__':
+    main()
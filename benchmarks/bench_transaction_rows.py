@@ -0,0 +1,85 @@
+"""
+Memory and throughput of building transaction records: per-row dicts versus Transaction.
+
+Uses synthetic rows shaped like psycopg2's output for SELECT * FROM transactions,
+so no database is needed.
+
+    python benchmarks/bench_transaction_rows.py [rows]
+"""
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import budget
+
+# Column order of the transactions table, as cursor.description reports it for SELECT *
+TABLE_COLUMNS = ('transaction_id', 'type', 'category', 'item', 'amount', 'date', 'description', 'savings_goal_id')
+
+
+class FakeCursor:
+    description = [(name, None, None, None, None, None, None) for name in TABLE_COLUMNS]
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def fetchall(self):
+        return list(self.rows)
+
+
+def make_rows(count):
+    start = date(2020, 1, 1)
+    categories = ('Food', 'Coffee', 'Rent', 'Shopping', 'Transportation')
+    return [
+        (i, 'expense', categories[i % 5], f'Item {i % 300}', Decimal(f'{i % 500}.{i % 100:02d}'),
+         start + timedelta(days=i % 2000), 'receipt', None)
+        for i in range(count)
+    ]
+
+
+def legacy_dict_from_row(row, cursor):
+    # What budget.dict_from_row() used to do for every row
+    return dict(zip([col[0] for col in cursor.description], row))
+
+
+def build_dicts(cursor):
+    return [legacy_dict_from_row(row, cursor) for row in cursor.fetchall()]
+
+
+def build_transactions(cursor):
+    return budget.fetch_transactions(cursor)
+
+
+def measure(label, func, rows):
+    gc.collect()
+    started = time.perf_counter()
+    func(FakeCursor(rows))
+    elapsed = time.perf_counter() - started
+
+    gc.collect()
+    tracemalloc.start()
+    result = func(FakeCursor(rows))
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    print(f'{label:<14} {len(rows) / elapsed:12.0f} rows/s  {current / len(rows):7.1f} bytes/row  '
+          f'{current / 2**20:8.1f} MiB total')
+    return elapsed, current
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    rows = make_rows(count)
+    dict_time, dict_memory = measure('dict rows', build_dicts, rows)
+    record_time, record_memory = measure('Transaction', build_transactions, rows)
+    print(f'{dict_time / record_time:.2f}x faster, {dict_memory / record_memory:.2f}x less memory')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,87 @@
-from datetime import datetime, timedelta
+import base64
+import os
+from datetime import date as date_type, datetime, timedelta
+from collections import defaultdict, namedtuple
+from decimal import Decimal, InvalidOperation
+from functools import partial
+from operator import itemgetter
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+import archive
 import db
 
-def dict_from_row(row, cursor):
-    """Converts a database row into a dictionary."""
-    return dict(zip([col[0] for col in cursor.description], row))
+TRANSACTION_TYPES = ('income', 'expense')
+# Submitted transaction fields that must be strings when present
+TEXT_FIELDS = ('type', 'category', 'item', 'description', 'date')
+# Longest the aggregate queries of one report may take together (within any budget of the caller)
+REPORT_DATA_QUERY_SECONDS = float(os.environ.get('REPORT_DATA_QUERY_SECONDS', 10))
+TRANSACTION_COLUMNS = ('transaction_id', 'date', 'type', 'category', 'item', 'amount', 'description', 'savings_goal_id')
+
+class Transaction(namedtuple('TransactionRow', TRANSACTION_COLUMNS, defaults=(None,) * len(TRANSACTION_COLUMNS))):
+    """
+    Compact, immutable record for one transactions row. Amounts are always Decimal (as NUMERIC comes back from Postgres).
+    Supports attribute access for templates and read-only mapping access (t['amount'], t.get(...)) for older callers.
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            if key not in TRANSACTION_COLUMNS:
+                raise KeyError(key)
+            return getattr(self, key)
+        return tuple.__getitem__(self, key)
+
+    def __contains__(self, key):
+        return key in TRANSACTION_COLUMNS
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in TRANSACTION_COLUMNS else default
+
+    def keys(self):
+        return TRANSACTION_COLUMNS
+
+    def as_dict(self):
+        return dict(zip(TRANSACTION_COLUMNS, self))
+
+# Builds a Transaction straight from a correctly ordered sequence, without a Python-level __init__
+_new_transaction = partial(tuple.__new__, Transaction)
+
+# Row-to-Transaction builders, cached per distinct column list so cursor.description is only walked once
+_transaction_factories = {}
+
+def transaction_factory(cursor):
+    """Returns a function turning a row from `cursor` into a Transaction."""
+    names = tuple(col[0] for col in cursor.description)
+    factory = _transaction_factories.get(names)
+    if factory is None:
+        positions = [names.index(c) if c in names else None for c in TRANSACTION_COLUMNS]
+        if names == TRANSACTION_COLUMNS:
+            factory = _new_transaction
+        elif None not in positions:
+            # Every column present, just in another order (e.g. SELECT *): reorder in C
+            getter = itemgetter(*positions)
+            factory = lambda row: _new_transaction(getter(row))
+        else:
+            factory = lambda row: _new_transaction([None if i is None else row[i] for i in positions])
+        _transaction_factories[names] = factory
+    return factory
+
+def fetch_transactions(cursor):
+    """Fetches the remaining rows of `cursor` as Transactions."""
+    make_transaction = transaction_factory(cursor)
+    return [make_transaction(row) for row in cursor.fetchall()]
+
+def to_amount(value):
+    """
+    Parses a submitted amount into the Decimal representation used for all transaction amounts.
+    Returns None unless it is a finite number with at most two decimal places; nothing is rounded.
+    """
+    try:
+        amount = Decimal(str(value).strip())
+        cents = amount.quantize(Decimal('0.01'))
+    except (InvalidOperation, ValueError):
+        return None
+    return cents if cents == amount else None
 
 def add_transaction(type, category, item, amount, date, description, savings_goal_id=None):
     """Adds a single transaction to the database."""
@@ -25,9 +103,105 @@ def add_transaction(type, category, item, amount, date, description, savings_goa
     finally:
         db.release_db_connection(conn)
 
-def get_transactions(sort_by_date=True):
-    """Reads all transactions from the database."""
+def validate_transaction_rows(rows, app_settings, savings_goal_ids):
+    """
+    Validates a batch of submitted transaction rows against one snapshot of the category settings.
+    Returns (clean_rows, errors); errors is a list of messages naming the offending row number.
+    """
+    valid_categories = {
+        'income': frozenset(app_settings['income_categories']),
+        'expense': frozenset(app_settings['expense_categories']),
+    }
+    goal_ids = frozenset(str(goal_id) for goal_id in savings_goal_ids)
+    today = datetime.now().strftime('%Y-%m-%d')
+    clean_rows = []
+    errors = []
+
+    for number, row in enumerate(rows, start=1):
+        # JSON rows can hold numbers or lists where text belongs
+        not_text = [name for name in TEXT_FIELDS if row.get(name) is not None and not isinstance(row[name], str)]
+        if not_text:
+            errors.append(f'Row {number}: {", ".join(not_text)} must be text.')
+            continue
+        transaction_type = (row.get('type') or '').strip()
+        category = (row.get('category') or '').strip()
+        item = (row.get('item') or '').strip()
+        description = (row.get('description') or '').strip()
+        date = (row.get('date') or '').strip() or today
+        savings_goal_id = str(row.get('savings_goal_id') or '').strip()
+
+        if transaction_type not in TRANSACTION_TYPES:
+            errors.append(f'Row {number}: type must be "income" or "expense".')
+            continue
+        if not item:
+            errors.append(f'Row {number}: item is required.')
+            continue
+        amount = to_amount(row.get('amount', 0))
+        if amount is None:
+            errors.append(f'Row {number}: amount must be a number with at most two decimal places.')
+            continue
+        if amount <= 0:
+            errors.append(f'Row {number}: amount must be greater than zero.')
+            continue
+        try:
+            datetime.strptime(date, '%Y-%m-%d')
+        except ValueError:
+            errors.append(f'Row {number}: date must be in YYYY-MM-DD format.')
+            continue
+        if category not in valid_categories[transaction_type]:
+            errors.append(f'Row {number}: unknown {transaction_type} category "{category}".')
+            continue
+
+        if transaction_type == 'expense' and category == 'Goal Savings':
+            if savings_goal_id not in goal_ids:
+                errors.append(f'Row {number}: please select a savings goal for "Goal Savings" category.')
+                continue
+        else:
+            savings_goal_id = ''
+
+        clean_rows.append({
+            'type': transaction_type,
+            'category': category,
+            'item': item,
+            'amount': amount,
+            'date': date,
+            'description': description,
+            'savings_goal_id': savings_goal_id,
+        })
+
+    return clean_rows, errors
+
+def add_transactions(rows):
+    """Inserts many validated transactions with a single multi-row INSERT in one database transaction."""
+    if not rows:
+        return 0
+    values = [
+        (
+            row['date'], row['type'], row['category'], row['item'], row['amount'], row['description'],
+            int(row['savings_goal_id']) if row.get('savings_goal_id') else None
+        )
+        for row in rows
+    ]
     conn = db.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            execute_values(
+                cur,
+                "INSERT INTO transactions (date, type, category, item, amount, description, savings_goal_id) VALUES %s;",
+                values,
+                page_size=len(values)
+            )
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db.release_db_connection(conn)
+    return len(values)
+
+def get_transactions(sort_by_date=True):
+    """Reads all hot transactions from the database; archived months are not included (see archive.py)."""
+    conn = db.get_read_connection()
     transactions = []
     try:
         with conn.cursor() as cur:
@@ -35,21 +209,245 @@ def get_transactions(sort_by_date=True):
             if sort_by_date:
                 query += " ORDER BY date DESC, transaction_id DESC"
             cur.execute(query)
-            for row in cur.fetchall():
-                transactions.append(dict_from_row(row, cur))
+            transactions = fetch_transactions(cur)
     finally:
         db.release_db_connection(conn)
     return transactions
 
+def encode_cursor(row_date, transaction_id):
+    """Opaque keyset cursor pointing just after (date, transaction_id) in date-descending order."""
+    raw = f'{row_date.isoformat()}|{transaction_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor. Raises ValueError for malformed cursors."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        row_date, transaction_id = raw.split('|')
+        return date_type.fromisoformat(row_date), int(transaction_id)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError('Invalid cursor.') from e
+
+def build_transaction_filters(filters):
+    """
+    Turns a dict of optional filters (type, category, item, start_date, end_date, search, since_id)
+    into a list of SQL conditions and their parameters.
+    """
+    conditions = []
+    params = []
+    if filters.get('type'):
+        conditions.append(sql.SQL('type = %s'))
+        params.append(filters['type'])
+    if filters.get('category'):
+        conditions.append(sql.SQL('category = %s'))
+        params.append(filters['category'])
+    if filters.get('item'):
+        conditions.append(sql.SQL('item = %s'))
+        params.append(filters['item'])
+    if filters.get('start_date'):
+        conditions.append(sql.SQL('date >= %s'))
+        params.append(filters['start_date'])
+    if filters.get('end_date'):
+        conditions.append(sql.SQL('date <= %s'))
+        params.append(filters['end_date'])
+    if filters.get('since_id'):
+        # Lets clients poll for rows added after the newest one they already hold
+        conditions.append(sql.SQL('transaction_id > %s'))
+        params.append(int(filters['since_id']))
+    if filters.get('search'):
+        conditions.append(sql.SQL('(item ILIKE %s OR description ILIKE %s OR category ILIKE %s)'))
+        pattern = f"%{filters['search']}%"
+        params.extend([pattern, pattern, pattern])
+    return conditions, params
+
+def keyset_page_query(columns, filters=None, cursor=None, limit=50, newer=False):
+    """
+    Builds the query for one keyset page (limit + 1 rows, to learn whether another page exists).
+    Pages run newest first; with newer=True the cursor is followed towards newer rows instead,
+    and the rows come back oldest first.
+    """
+    conditions, params = build_transaction_filters(filters or {})
+    if cursor:
+        cursor_date, cursor_id = decode_cursor(cursor)
+        conditions.append(sql.SQL('(date, transaction_id) > (%s, %s)' if newer else '(date, transaction_id) < (%s, %s)'))
+        params.extend([cursor_date, cursor_id])
+
+    where = sql.SQL(' WHERE ') + sql.SQL(' AND ').join(conditions) if conditions else sql.SQL('')
+    order = 'ASC' if newer else 'DESC'
+    query = sql.SQL("SELECT {columns} FROM transactions{where} ORDER BY date {order}, transaction_id {order} LIMIT %s").format(
+        columns=sql.SQL(', ').join(sql.Identifier(c) for c in columns),
+        where=where,
+        order=sql.SQL(order)
+    )
+    params.append(limit + 1)
+    return query, params
+
+def get_transactions_page(limit=50, cursor=None, filters=None, fields=None):
+    """
+    Reads one keyset-paginated page of transactions, newest first.
+    `fields` restricts the queried columns (transaction_id and date are always included for the cursor);
+    the other attributes of the returned Transactions are None.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    fields = [f for f in (fields or TRANSACTION_COLUMNS) if f in TRANSACTION_COLUMNS]
+    columns = list(dict.fromkeys(['transaction_id', 'date'] + fields))
+    query, params = keyset_page_query(columns, filters, cursor, limit)
+
+    conn = db.get_read_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(query, params)
+            rows = fetch_transactions(cur)
+    finally:
+        db.release_db_connection(conn)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['date'], rows[-1]['transaction_id'])
+    return rows, next_cursor
+
+# Filters the ledger pages take. A search leaves gaps in the ledger, so its pages have no running balances.
+LEDGER_FILTERS = ('start_date', 'end_date', 'search')
+# Stand-ins for a missing date filter or cursor, so every page runs one of the four fixed statements below
+OPEN_DATE_RANGE = ('-infinity', 'infinity')
+FIRST_PAGE_CURSOR = {False: ('infinity', 2**31 - 1), True: ('-infinity', 0)}
+
+def _ledger_statement(with_balances, newer):
+    return f"ledger_{'balances' if with_balances else 'rows'}_{'newer' if newer else 'older'}"
+
+def _ledger_query(with_balances, newer):
+    """
+    The ledger page query: limit + 1 rows past the cursor, newest first (oldest first with newer=True).
+    Takes the date bounds, the search pattern three times (rows only), the cursor's date and id, and the limit.
+    """
+    order = 'ASC' if newer else 'DESC'
+    page = f"""
+        SELECT {', '.join(TRANSACTION_COLUMNS)} FROM transactions
+        WHERE date >= %s AND date <= %s
+          {'' if with_balances else 'AND (item ILIKE %s OR description ILIKE %s OR category ILIKE %s)'}
+          AND (date, transaction_id) {'>' if newer else '<'} (%s, %s)
+        ORDER BY date {order}, transaction_id {order} LIMIT %s
+    """
+    if not with_balances:
+        return page
+    return f"""
+        WITH page AS ({page}),
+        opening AS (
+            SELECT COALESCE((SELECT SUM(net_change) FROM monthly_balances
+                             WHERE month < date_trunc('month', first_row.date)::date), 0)
+                 -- Archived rows count as coming before any hot row of their month
+                 + COALESCE((SELECT SUM(CASE WHEN type = 'income' THEN total ELSE -total END) FROM archived_totals
+                             WHERE month <= date_trunc('month', first_row.date)::date), 0)
+                 + COALESCE((SELECT SUM(CASE WHEN type = 'income' THEN amount ELSE -amount END) FROM transactions
+                             WHERE date >= date_trunc('month', first_row.date)::date
+                               AND (date, transaction_id) < (first_row.date, first_row.transaction_id)), 0) AS balance
+            FROM (SELECT date, transaction_id FROM page ORDER BY date, transaction_id LIMIT 1) AS first_row
+        )
+        SELECT page.*, opening.balance + SUM(CASE WHEN type = 'income' THEN amount ELSE -amount END)
+                   OVER (ORDER BY date, transaction_id) AS running_balance
+        FROM page CROSS JOIN opening
+        ORDER BY date {order}, transaction_id {order};
+    """
+
+for _with_balances in (True, False):
+    for _newer in (False, True):
+        db.register_statement(_ledger_statement(_with_balances, _newer), _ledger_query(_with_balances, _newer))
+
+def get_ledger_page(limit=50, cursor=None, newer=False, filters=None):
+    """
+    Reads one keyset page of the ledger, newest first, that can be browsed in both directions:
+    `cursor` continues past a row towards older rows, or towards newer ones with newer=True.
+    `filters` may hold start_date, end_date (inclusive, YYYY-MM-DD) and search; ValueError if they don't parse.
+
+    Each row also gets its running balance (all income minus all expenses up to and including it,
+    archived months included). The balance before the page's oldest row comes from the monthly_balances
+    checkpoints and archived totals plus the rows earlier in that same month; a window over the page
+    does the rest, so the cost doesn't grow with the history. A search leaves gaps in the ledger, so balances are then None.
+
+    Returns (rows, balances, older_cursor, newer_cursor); balances maps transaction_id to Decimal.
+    """
+    filters = filters or {}
+    unsupported = [name for name, value in filters.items() if value and name not in LEDGER_FILTERS]
+    if unsupported:
+        raise ValueError(f"Unsupported ledger filters: {', '.join(unsupported)}")
+    with_balances = not filters.get('search')
+    params = []
+    for name, unbounded in zip(('start_date', 'end_date'), OPEN_DATE_RANGE):
+        value = filters.get(name)
+        # Parsed here so a bad date (e.g. 2024-13-01) is a ValueError for the caller, not a DataError from Postgres
+        params.append(date_type.fromisoformat(str(value)) if value else unbounded)
+    if not with_balances:
+        pattern = f"%{filters['search']}%"
+        params.extend([pattern, pattern, pattern])
+    params.extend(decode_cursor(cursor) if cursor else FIRST_PAGE_CURSOR[newer])
+    params.append(limit + 1)
+    statement = _ledger_statement(with_balances, newer)
+
+    conn = db.get_read_connection()
+    try:
+        with conn.cursor() as cur:
+            db.execute_statement(cur, statement, params)
+            make_transaction = transaction_factory(cur)
+            raw_rows = cur.fetchall()
+    finally:
+        db.release_db_connection(conn)
+
+    has_more = len(raw_rows) > limit
+    if newer and not has_more:
+        # Reached the newest rows: show a full first page rather than whatever was left over
+        return get_ledger_page(limit, filters=filters)
+    raw_rows = raw_rows[:limit]
+    if newer:
+        raw_rows.reverse()
+    rows = [make_transaction(row) for row in raw_rows]
+    balances = {row[0]: row[-1] for row in raw_rows} if with_balances else None
+
+    older_cursor = newer_cursor = None
+    if rows:
+        # Coming from the other direction means there is something on that side
+        if has_more or newer:
+            older_cursor = encode_cursor(rows[-1].date, rows[-1].transaction_id)
+        if newer or cursor:
+            newer_cursor = encode_cursor(rows[0].date, rows[0].transaction_id)
+    return rows, balances, older_cursor, newer_cursor
+
+def count_transactions():
+    """
+    Total number of hot (not archived) transactions, read from the monthly checkpoints rather than
+    counting the table. archive.archived_summary() counts the archived ones.
+    """
+    conn = db.get_read_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT COALESCE(SUM(transaction_count), 0) FROM monthly_balances;")
+            return int(cur.fetchone()[0])
+    finally:
+        db.release_db_connection(conn)
+
+def get_data_generation():
+    """
+    Returns (generation, rewrite_generation) for the transactions table.
+    generation changes on every write; rewrite_generation only on updates and deletes.
+    """
+    conn = db.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT generation, rewrite_generation FROM data_generation;")
+            row = cur.fetchone()
+    finally:
+        db.release_db_connection(conn)
+    return (row[0], row[1]) if row else (0, 0)
+
 def get_transaction(transaction_id):
     """Retrieves a single transaction by its ID from the database."""
-    conn = db.get_db_connection()
+    conn = db.get_read_connection()
     try:
         with conn.cursor() as cur:
             cur.execute("SELECT * FROM transactions WHERE transaction_id = %s;", (transaction_id,))
             row = cur.fetchone()
             if row:
-                return dict_from_row(row, cur)
+                return transaction_factory(cur)(row)
     finally:
         db.release_db_connection(conn)
     return None
@@ -86,10 +484,85 @@ def update_transaction(transaction_id, data):
     finally:
         db.release_db_connection(conn)
 
-def generate_report_data(period=None, start_date_str=None, end_date_str=None):
-    """Generates budget report data for a given period or custom date range using database queries."""
+def bulk_delete_transactions(transaction_ids):
+    """
+    Deletes many transactions with one DELETE ... WHERE transaction_id = ANY(%s).
+    Returns the deleted rows so callers can reverse their savings-goal contributions.
+    """
+    if not transaction_ids:
+        return []
+    conn = db.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "DELETE FROM transactions WHERE transaction_id = ANY(%s) RETURNING *;",
+                (list(transaction_ids),)
+            )
+            deleted = fetch_transactions(cur)
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db.release_db_connection(conn)
+    return deleted
+
+def bulk_update_transactions(transaction_ids, changes, only_type=None):
+    """
+    Applies the same column changes (e.g. {'date': ...} or {'category': ..., 'savings_goal_id': ...})
+    to many transactions in one UPDATE ... WHERE transaction_id = ANY(%s).
+    If only_type is given, rows of the other transaction type are left untouched.
+    Returns (old_rows, new_rows) so callers can recompute savings-goal progress from the difference.
+    """
+    allowed_columns = ('date', 'category', 'savings_goal_id')
+    if not transaction_ids or not changes:
+        return [], []
+    if any(column not in allowed_columns for column in changes):
+        raise ValueError(f"Only {', '.join(allowed_columns)} can be bulk-updated.")
+
+    assignments = sql.SQL(', ').join(
+        sql.SQL('{} = %s').format(sql.Identifier(column)) for column in changes
+    )
+    type_filter = sql.SQL(' AND type = %s') if only_type else sql.SQL('')
+    # The CTE reads the pre-update snapshot, so one round-trip returns both old and new values
+    query = sql.SQL(
+        "WITH old AS ("
+        "SELECT transaction_id, type, category, amount, savings_goal_id FROM transactions "
+        "WHERE transaction_id = ANY(%s){type_filter} FOR UPDATE"
+        ") "
+        "UPDATE transactions t SET {assignments} FROM old "
+        "WHERE t.transaction_id = old.transaction_id "
+        "RETURNING old.type, old.category, old.amount, old.savings_goal_id, "
+        "t.type, t.category, t.amount, t.savings_goal_id;"
+    ).format(type_filter=type_filter, assignments=assignments)
+    params = [list(transaction_ids)]
+    if only_type:
+        params.append(only_type)
+    params.extend(changes.values())
+
+    conn = db.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(query, params)
+            rows = cur.fetchall()
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db.release_db_connection(conn)
+
+    old_rows = [Transaction(type=row[0], category=row[1], amount=row[2], savings_goal_id=row[3]) for row in rows]
+    new_rows = [Transaction(type=row[4], category=row[5], amount=row[6], savings_goal_id=row[7]) for row in rows]
+    return old_rows, new_rows
+
+def report_date_range(period=None, start_date_str=None, end_date_str=None):
+    """
+    The (period, start, end) datetimes a report covers; end is exclusive. An explicit start and end
+    date win over the period, and an unknown period means this month.
+    """
     today = datetime.now()
-    
+
     if start_date_str and end_date_str:
         start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
         end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
@@ -108,63 +581,108 @@ def generate_report_data(period=None, start_date_str=None, end_date_str=None):
             start_date = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
             next_month = (start_date.replace(day=28) + timedelta(days=4)).replace(day=1)
             end_date = next_month
+    return period, start_date, end_date
 
-    conn = db.get_db_connection()
+# The report queries, prepared once per connection (see db.execute_statement()); all take (start, end)
+db.register_statement(
+    'report_transactions',
+    "SELECT * FROM transactions WHERE date >= %s AND date < %s ORDER BY date DESC, transaction_id DESC;"
+)
+db.register_statement(
+    'report_totals',
+    "SELECT type, category, SUM(amount) as total FROM transactions "
+    "WHERE date >= %s AND date < %s GROUP BY type, category;"
+)
+db.register_statement(
+    'report_income_by_item',
+    "SELECT item, SUM(amount) as total FROM transactions "
+    "WHERE type = 'income' AND date >= %s AND date < %s "
+    "GROUP BY item ORDER BY total DESC;"
+)
+db.register_statement(
+    'report_months',
+    "SELECT TO_CHAR(date, 'YYYY-MM') as month, type, SUM(amount), "
+    "SUM(amount) FILTER (WHERE category IN ('Goal Savings', 'General Savings')) "
+    "FROM transactions WHERE date >= %s AND date < %s "
+    "GROUP BY month, type ORDER BY month;"
+)
+
+@db.query_budget(REPORT_DATA_QUERY_SECONDS)
+def generate_report_data(period=None, start_date_str=None, end_date_str=None, include_transactions=True):
+    """
+    Generates budget report data for a given period or custom date range using database queries.
+    Archived months are merged in from their stored totals; with include_transactions their rows are
+    also read back from the archive files. With include_transactions=False only the aggregates are
+    queried and "transactions" is empty.
+    """
+    period, start_date, end_date = report_date_range(period, start_date_str, end_date_str)
+
+    conn = db.get_read_connection()
     try:
         with conn.cursor() as cur:
+            archived = archive.summarize_range(cur, start_date.date(), end_date.date())
+
             # Fetch filtered transactions
-            cur.execute(
-                "SELECT * FROM transactions WHERE date >= %s AND date < %s ORDER BY date DESC, transaction_id DESC;",
-                (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
-            )
-            filtered_transactions = [dict_from_row(row, cur) for row in cur.fetchall()]
+            filtered_transactions = []
+            if include_transactions:
+                db.execute_statement(cur, 'report_transactions', (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')))
+                filtered_transactions = fetch_transactions(cur)
+                if archived:
+                    filtered_transactions.extend(archive.iter_transactions(cur, start_date.date(), end_date.date()))
+                    filtered_transactions.sort(key=itemgetter(1, 0), reverse=True)
 
             # Fetch aggregated data
-            cur.execute(
-                "SELECT type, category, SUM(amount) as total FROM transactions "
-                "WHERE date >= %s AND date < %s GROUP BY type, category;",
-                (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
-            )
+            db.execute_statement(cur, 'report_totals', (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')))
             summary_data = cur.fetchall()
+            if archived:
+                merged = defaultdict(Decimal, {(row[0], row[1]): row[2] for row in summary_data})
+                for key, total in archived['totals'].items():
+                    merged[key] += total
+                summary_data = [(row_type, category, total) for (row_type, category), total in merged.items()]
             
             total_income = sum(s[2] for s in summary_data if s[0] == 'income')
             total_expense = sum(s[2] for s in summary_data if s[0] == 'expense')
             total_goal_savings = sum(s[2] for s in summary_data if s[1] == 'Goal Savings')
             total_general_savings = sum(s[2] for s in summary_data if s[1] == 'General Savings')
+            expense_breakdown_by_category = {
+                s[1]: float(s[2]) for s in sorted(summary_data, key=lambda s: s[2], reverse=True) if s[0] == 'expense'
+            }
             
             # Income breakdown by item
-            cur.execute(
-                "SELECT item, SUM(amount) as total FROM transactions "
-                "WHERE type = 'income' AND date >= %s AND date < %s "
-                "GROUP BY item ORDER BY total DESC;",
-                (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
-            )
-            income_breakdown_by_item = {row[0]: float(row[1]) for row in cur.fetchall()}
+            db.execute_statement(cur, 'report_income_by_item', (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')))
+            income_by_item = cur.fetchall()
+            if archived:
+                merged = defaultdict(Decimal, income_by_item)
+                for item, total in archived['income_items'].items():
+                    merged[item] += total
+                income_by_item = sorted(merged.items(), key=itemgetter(1), reverse=True)
+            income_breakdown_by_item = {row[0]: float(row[1]) for row in income_by_item}
 
             # Monthly summaries for yearly report
             monthly_summaries = []
             if period == 'yearly':
-                cur.execute(
-                    "SELECT TO_CHAR(date, 'YYYY-MM') as month, type, SUM(amount) "
-                    "FROM transactions WHERE date >= %s AND date < %s "
-                    "GROUP BY month, type ORDER BY month;",
-                    (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
-                )
+                db.execute_statement(cur, 'report_months', (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')))
+                month_rows = cur.fetchall()
+                if archived:
+                    month_rows.extend((month, trans_type, total, savings)
+                                      for (month, trans_type), (total, savings) in archived['months'].items())
                 month_data = {}
-                for row in cur.fetchall():
-                    month, trans_type, total = row
+                for row in month_rows:
+                    month, trans_type, total, savings = row
                     if month not in month_data:
-                        month_data[month] = {'total_income': 0, 'total_expense': 0}
+                        month_data[month] = {'total_income': 0, 'total_expense': 0, 'total_savings': 0}
                     if trans_type == 'income':
-                        month_data[month]['total_income'] = float(total)
+                        month_data[month]['total_income'] += float(total)
                     else:
                         month_data[month]['total_expense'] += float(total)
+                    month_data[month]['total_savings'] += float(savings or 0)
 
                 for month, values in sorted(month_data.items()):
                     monthly_summaries.append({
                         'month': month,
                         'total_income': values['total_income'],
                         'total_expense': values['total_expense'],
+                        'total_savings': values['total_savings'],
                         'balance': values['total_income'] - values['total_expense']
                     })
 
@@ -183,5 +701,223 @@ def generate_report_data(period=None, start_date_str=None, end_date_str=None):
         "balance": float(total_income - total_expense),
         "transactions": filtered_transactions,
         "income_breakdown_by_item": income_breakdown_by_item,
-        "monthly_summaries": monthly_summaries
-    }
\ No newline at end of file
+        "expense_breakdown_by_category": expense_breakdown_by_category,
+        "monthly_summaries": monthly_summaries,
+        "archived_transaction_count": archived['transaction_count'] if archived else 0
+    }
+
+def comparison_ranges(start_date, end_date):
+    """
+    The [start, end) date ranges a report period is compared with: the period just before it, and the
+    same dates a year earlier. Whole-month periods step back by whole months, so March follows February.
+    """
+    def year_earlier(day):
+        try:
+            return day.replace(year=day.year - 1)
+        except ValueError:  # 29 February
+            return day.replace(year=day.year - 1, day=28)
+
+    if start_date.day == 1 and end_date.day == 1:
+        months = (end_date.year - start_date.year) * 12 + end_date.month - start_date.month
+        previous = (archive.add_months(start_date, -months), start_date)
+    else:
+        previous = (start_date - (end_date - start_date), start_date)
+    return {
+        'current': (start_date, end_date),
+        'previous': previous,
+        'year_ago': (year_earlier(start_date), year_earlier(end_date)),
+    }
+
+# Every (type, category, item) total of the three compared ranges in one scan, with each category's
+# totals alongside from a window over the grouped rows. Takes the three (start, end) pairs twice.
+db.register_statement(
+    'report_comparison',
+    "SELECT type, category, item, current, previous, year_ago, "
+    "SUM(current) OVER per_category, SUM(previous) OVER per_category, SUM(year_ago) OVER per_category "
+    "FROM ("
+    "    SELECT type, category, item, "
+    "    COALESCE(SUM(amount) FILTER (WHERE date >= %s AND date < %s), 0) AS current, "
+    "    COALESCE(SUM(amount) FILTER (WHERE date >= %s AND date < %s), 0) AS previous, "
+    "    COALESCE(SUM(amount) FILTER (WHERE date >= %s AND date < %s), 0) AS year_ago "
+    "    FROM transactions "
+    "    WHERE (date >= %s AND date < %s) OR (date >= %s AND date < %s) OR (date >= %s AND date < %s) "
+    "    GROUP BY type, category, item"
+    ") AS items "
+    "WINDOW per_category AS (PARTITION BY type, category);"
+)
+
+def compare_amounts(current, previous, year_ago):
+    """The three amounts with their changes; a percentage is None when there is nothing to compare with."""
+    def percent(change, base):
+        return float(change / abs(base) * 100) if base else None
+
+    return {
+        'current': float(current),
+        'previous': float(previous),
+        'year_ago': float(year_ago),
+        'change_previous': float(current - previous),
+        'percent_previous': percent(current - previous, previous),
+        'change_year': float(current - year_ago),
+        'percent_year': percent(current - year_ago, year_ago),
+    }
+
+@db.query_budget(REPORT_DATA_QUERY_SECONDS)
+def generate_comparison_data(period=None, start_date_str=None, end_date_str=None):
+    """
+    Compares a report period (as generate_report_data() picks it) with the period before and the same
+    period a year earlier: totals, then each category and its items, with changes and percentages.
+    Archived months are merged in from their stored totals.
+    """
+    period, start_date, end_date = report_date_range(period, start_date_str, end_date_str)
+    ranges = comparison_ranges(start_date.date(), end_date.date())
+    bounds = [day for name in ('current', 'previous', 'year_ago') for day in ranges[name]]
+
+    conn = db.get_read_connection()
+    try:
+        with conn.cursor() as cur:
+            db.execute_statement(cur, 'report_comparison', bounds + bounds)
+            rows = cur.fetchall()
+            archived = {name: archive.summarize_range(cur, start, end) for name, (start, end) in ranges.items()}
+    finally:
+        db.release_db_connection(conn)
+
+    items = {(row[0], row[1], row[2]): list(row[3:6]) for row in rows}
+    category_totals = {(row[0], row[1]): list(row[6:9]) for row in rows}
+    if any(archived.values()):
+        for index, name in enumerate(('current', 'previous', 'year_ago')):
+            for key, amount in (archived[name] or {}).get('items', {}).items():
+                items.setdefault(key, [Decimal(0)] * 3)[index] += amount
+        category_totals = defaultdict(lambda: [Decimal(0)] * 3)
+        for (row_type, category, _), amounts in items.items():
+            totals = category_totals[(row_type, category)]
+            for index, amount in enumerate(amounts):
+                totals[index] += amount
+
+    categories = {
+        key: {'type': key[0], 'category': key[1], **compare_amounts(*amounts), 'items': []}
+        for key, amounts in category_totals.items()
+    }
+    for (row_type, category, item), amounts in items.items():
+        categories[(row_type, category)]['items'].append({'item': item, **compare_amounts(*amounts)})
+    for entry in categories.values():
+        entry['items'].sort(key=lambda row: (-row['current'], -row['previous'], row['item']))
+
+    income = [sum(totals[i] for (row_type, _), totals in category_totals.items() if row_type == 'income') for i in range(3)]
+    expense = [sum(totals[i] for (row_type, _), totals in category_totals.items() if row_type == 'expense') for i in range(3)]
+    return {
+        'period': period,
+        'ranges': {
+            name: {'start_date': start.isoformat(), 'end_date': (end - timedelta(days=1)).isoformat()}
+            for name, (start, end) in ranges.items()
+        },
+        'totals': [
+            {'label': 'Income', **compare_amounts(*income)},
+            {'label': 'Expense', **compare_amounts(*expense)},
+            {'label': 'Balance', **compare_amounts(*(i - e for i, e in zip(income, expense)))},
+        ],
+        # Income first, then the biggest categories of the current period
+        'categories': sorted(categories.values(), key=lambda row: (row['type'] != 'income', -row['current'],
+                                                                   -row['previous'], row['category'])),
+    }
+
+def normalize_item(item):
+    """The key items are grouped by: case and runs of whitespace folded. Same as the normalize_item() SQL function."""
+    return ' '.join(item.split()).lower()
+
+ITEM_ORDERS = {
+    'total': 'total DESC, transaction_count DESC, item_key',
+    'count': 'transaction_count DESC, total DESC, item_key',
+}
+# Per-item totals of [start, end): whole months from item_monthly_stats and archived_totals, the rows of a partly
+# covered first and last month from the ledger. Takes type, the whole-month bounds, type and the whole-month
+# bounds again, then type and the two [start, end) edges, and the limit (NULL for all).
+for order, order_by in ITEM_ORDERS.items():
+    db.register_statement(f'top_items_by_{order}', f"""
+        WITH period_rows AS (
+            SELECT item_key, item, total, transaction_count
+            FROM item_monthly_stats WHERE type = %s AND month >= %s AND month < %s
+            UNION ALL
+            SELECT normalize_item(item), btrim(item), total, transaction_count
+            FROM archived_totals WHERE type = %s AND month >= %s AND month < %s
+            UNION ALL
+            SELECT normalize_item(item), btrim(item), amount, 1
+            FROM transactions WHERE type = %s AND ((date >= %s AND date < %s) OR (date >= %s AND date < %s))
+        )
+        SELECT item_key, MIN(item) AS item, SUM(total) AS total, SUM(transaction_count) AS transaction_count
+        FROM period_rows
+        GROUP BY item_key
+        ORDER BY {order_by}
+        LIMIT %s;
+    """)
+# When each item key was first and last seen in the whole ledger, archive included. Takes type, keys, type, keys.
+db.register_statement('item_first_last_seen', """
+    SELECT item_key, MIN(first_date), MAX(last_date) FROM (
+        SELECT item_key, first_date, last_date
+        FROM item_monthly_stats WHERE type = %s AND item_key = ANY(%s)
+        UNION ALL
+        SELECT normalize_item(item), first_date, last_date
+        FROM archived_totals WHERE type = %s AND normalize_item(item) = ANY(%s)
+    ) AS seen
+    GROUP BY item_key;
+""")
+
+@db.query_budget(REPORT_DATA_QUERY_SECONDS)
+def get_top_items(period=None, start_date_str=None, end_date_str=None, transaction_type='expense', limit=10, order='total'):
+    """
+    The top `limit` items (merchants, for expenses) of a report period by total or by number of
+    transactions ('count'), with their average ticket and when they were first and last seen.
+    Items are grouped by normalize_item(). Reads the per-item monthly aggregates, so the cost follows
+    the number of months and items in the period rather than the number of transactions.
+    """
+    period, start, end = report_date_range(period, start_date_str, end_date_str)
+    start_date, end_date = start.date(), end.date()
+    full_start = start_date if start_date.day == 1 else archive.add_months(start_date, 1)
+    full_end = archive.month_start(end_date)
+    # Parts of the range outside whole months, read row by row; an empty edge is (end_date, end_date)
+    if full_start < full_end:
+        edges = [(start_date, full_start), (full_end, end_date)]
+    else:
+        edges = [(start_date, end_date), (end_date, end_date)]
+
+    conn = db.get_read_connection()
+    try:
+        with conn.cursor() as cur:
+            archived_edges = [edge for edge in edges if edge[0] < edge[1] and archive.has_chunks(cur, *edge)]
+            db.execute_statement(cur, f'top_items_by_{order}', (
+                transaction_type, full_start, full_end,
+                transaction_type, full_start, full_end,
+                transaction_type, *edges[0], *edges[1],
+                # Rows of archived part-months are added below, so every item must be ranked after that
+                None if archived_edges else limit,
+            ))
+            items = {key: [item, total, count] for key, item, total, count in cur.fetchall()}
+
+            if archived_edges:
+                for edge_start, edge_end in archived_edges:
+                    for transaction in archive.iter_transactions(cur, edge_start, edge_end):
+                        if transaction.type == transaction_type:
+                            entry = items.setdefault(normalize_item(transaction.item), [transaction.item.strip(), 0, 0])
+                            entry[1] += transaction.amount
+                            entry[2] += 1
+                sort_key = ((lambda key: (-items[key][1], -items[key][2], key)) if order == 'total'
+                            else (lambda key: (-items[key][2], -items[key][1], key)))
+                items = {key: items[key] for key in sorted(items, key=sort_key)[:limit]}
+
+            keys = list(items)
+            db.execute_statement(cur, 'item_first_last_seen', (transaction_type, keys, transaction_type, keys))
+            seen = {key: (first, last) for key, first, last in cur.fetchall()}
+    finally:
+        db.release_db_connection(conn)
+
+    return [
+        {
+            'item': item,
+            'item_key': key,
+            'total': float(total),
+            'count': int(count),
+            'average': float(total / count),
+            'first_seen': seen.get(key, (None, None))[0],
+            'last_seen': seen.get(key, (None, None))[1],
+        }
+        for key, (item, total, count) in items.items()
+    ]
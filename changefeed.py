@@ -0,0 +1,115 @@
+import json
+import os
+import queue
+import select
+import threading
+import time
+import psycopg2
+import db
+
+# Comment line sent on idle streams so proxies keep them open and dead clients are noticed
+HEARTBEAT_SECONDS = 15
+# Streams end after this long; EventSource reconnects on its own, which bounds stuck server threads
+STREAM_SECONDS = 300
+# Open streams per worker process. Each holds a request thread for up to STREAM_SECONDS, so this stays
+# well below db.WEB_THREADS and leaves the rest to page traffic.
+MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', max(1, db.WEB_THREADS // 4)))
+SUBSCRIBER_QUEUE_SIZE = 100
+RECONNECT_SECONDS = 5
+
+
+class TooManyStreams(Exception):
+    """Raised when this worker already serves MAX_STREAMS streams."""
+
+
+class ChangeFeed:
+    """
+    One LISTEN connection per worker process, fanned out to every subscribed SSE stream.
+
+    The listener thread starts with the first subscriber, so each gunicorn worker opens its own
+    connection after forking. A subscriber that falls too far behind gets a single 'resync'
+    event instead of the backlog.
+    """
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self):
+        subscription = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            if len(self._subscribers) >= MAX_STREAMS:
+                raise TooManyStreams()
+            self._subscribers.add(subscription)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._listen_forever, name='changefeed', daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def next_event(self, subscription, timeout):
+        """The next event for this subscriber, or None after `timeout` seconds without one."""
+        try:
+            return subscription.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.put_nowait(event)
+            except queue.Full:
+                # Drop the backlog; the page re-fetches everything it shows on 'resync'
+                with subscription.mutex:
+                    subscription.queue.clear()
+                subscription.put_nowait({'table': 'resync', 'op': 'RESYNC'})
+
+    def _listen_forever(self):
+        while True:
+            try:
+                self._listen()
+            except psycopg2.Error:
+                pass
+            # Events may have been missed while disconnected
+            self.publish({'table': 'resync', 'op': 'RESYNC'})
+            time.sleep(RECONNECT_SECONDS)
+
+    def _listen(self):
+        conn = db.open_listener_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {db.CHANGE_CHANNEL};")
+            while True:
+                if select.select([conn], [], [], HEARTBEAT_SECONDS) == ([], [], []):
+                    continue
+                conn.poll()
+                # Several statements in one burst collapse to one event per (table, op)
+                events = {}
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        event = json.loads(notify.payload)
+                    except ValueError:
+                        continue
+                    events[(event.get('table'), event.get('op'))] = event
+                for event in events.values():
+                    self.publish(event)
+        finally:
+            conn.close()
+
+
+feed = ChangeFeed()
+
+
+def format_sse(event):
+    """One Server-Sent Events message, named after the changed table."""
+    message = f"event: {event['table']}\ndata: {json.dumps(event)}\n"
+    if event.get('generation') is not None:
+        message += f"id: {event['generation']}\n"
+    return message + '\n'
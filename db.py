@@ -1,11 +1,152 @@
+import contextlib
+import contextvars
+import itertools
+import json
 import os
+import re
+import socket
+import sys
+import threading
+import time
+import weakref
 import psycopg2
-from psycopg2 import pool
+import psycopg2.extensions
+from psycopg2 import pool, sql
 import urllib.parse as urlparse
-import settings_manager # Added import
+
+# Optional read replicas: comma-separated DSNs in the same format as DATABASE_URL
+REPLICA_DATABASE_URLS = [url.strip() for url in os.environ.get('REPLICA_DATABASE_URLS', '').split(',') if url.strip()]
+# How long a session that just wrote keeps reading from the primary, so it sees its own changes
+READ_YOUR_WRITES_SECONDS = float(os.environ.get('READ_YOUR_WRITES_SECONDS', 5))
+# How long a replica that failed is skipped before it is tried again
+REPLICA_RETRY_SECONDS = float(os.environ.get('REPLICA_RETRY_SECONDS', 30))
+
+# Longest any statement may run unless a query budget allows less (0 disables the limit)
+STATEMENT_TIMEOUT_SECONDS = float(os.environ.get('STATEMENT_TIMEOUT_SECONDS', 30))
+# How often statements running under a budget check that their client is still connected
+DISCONNECT_CHECK_SECONDS = 0.5
+
+# Request threads per worker process; the Procfile passes the same value to gunicorn --threads
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 16))
+# Connections per pool: one for every request thread plus the background threads that borrow one
+# (recurring scheduler, query watchdog, analytics refresh, spare)
+POOL_MAX_CONNECTIONS = int(os.environ.get('POOL_MAX_CONNECTIONS', WEB_THREADS + 4))
+
+# Postgres NOTIFY channel carrying change events for live page updates
+CHANGE_CHANNEL = 'budget_changes'
 
 # Create a connection pool
 db_pool = None
+replica_pools = [None] * len(REPLICA_DATABASE_URLS)
+_replica_down_until = [0.0] * len(REPLICA_DATABASE_URLS)
+_replica_of_connection = {}  # id(conn) -> replica index, for connections handed out by get_read_connection()
+_replica_lock = threading.Lock()
+_next_replica = itertools.count()
+
+_read_from_primary = contextvars.ContextVar('read_from_primary', default=False)
+_committed = contextvars.ContextVar('committed', default=False)
+# List collecting (statement, seconds, rows) while a request is being profiled; None otherwise
+_query_log = contextvars.ContextVar('query_log', default=None)
+# time.monotonic() by which the current query budget runs out, and the socket of the client waiting on it
+_query_deadline = contextvars.ContextVar('query_deadline', default=None)
+_client_socket = contextvars.ContextVar('client_socket', default=None)
+
+_watched = {}  # id(conn) -> (conn, client socket), for connections checked out under a query budget
+_session_timeouts = set()  # id(conn) of replica connections whose statement_timeout was changed for a budget
+_watch_lock = threading.Lock()
+_watch_thread = None
+
+# Statement registry: name -> SQL with $n parameters (see register_statement())
+_statements = {}
+# Pooled connection -> names already PREPAREd on it. Weak, so a connection the pool closes takes its entry with it.
+_prepared = weakref.WeakKeyDictionary()
+_prepared_lock = threading.Lock()
+_STATEMENT_NAME = re.compile(r'[a-z_][a-z0-9_]*\Z')
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised instead of starting a query when the current query budget has already run out."""
+
+
+class PrimaryConnection(psycopg2.extensions.connection):
+    """Primary connection that notes each commit, so the caller can pin the writer's next reads to the primary."""
+
+    def commit(self):
+        super().commit()
+        _committed.set(True)
+
+
+class BudgetedCursor(psycopg2.extensions.cursor):
+    """
+    Cursor that limits each statement to what is left of the query budget when it starts, so later
+    statements on a connection checked out early don't get the time that has already been spent.
+    """
+
+    def execute(self, query, vars=None):
+        return super().execute(self._with_remaining_budget(query), vars)
+
+    def executemany(self, query, vars_list):
+        return super().executemany(self._with_remaining_budget(query), vars_list)
+
+    def _with_remaining_budget(self, query):
+        deadline = _query_deadline.get()
+        # A named (server-side) cursor wraps the query in DECLARE, which takes a single statement
+        if deadline is None or self.name is not None:
+            return query
+        remaining_ms = int((deadline - time.monotonic()) * 1000)
+        if remaining_ms <= 0:
+            raise QueryBudgetExceeded()
+        if isinstance(query, sql.Composable):
+            query = query.as_string(self)
+        elif isinstance(query, bytes):
+            query = query.decode()
+        # Sent along with the statement, so it costs no extra round trip; see _with_query_budget() for the scope
+        scope = 'SESSION' if self.connection.autocommit else 'LOCAL'
+        return f"SET {scope} statement_timeout = {remaining_ms}; {query}"
+
+
+class TimedCursor(BudgetedCursor):
+    """Cursor that records each statement's duration in the active query log (see start_query_log())."""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self._record(query, time.perf_counter() - start)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            self._record(query, time.perf_counter() - start)
+
+    def _record(self, query, seconds):
+        log = _query_log.get()
+        if log is None:
+            return
+        if isinstance(query, sql.Composable):
+            query = query.as_string(self)
+        elif isinstance(query, bytes):
+            query = query.decode(errors='replace')
+        log.append((query, seconds, self.rowcount))
+
+
+def make_pool(database_url, **kwargs):
+    url = urlparse.urlparse(database_url)
+    # Threaded: request threads and background threads all check connections in and out
+    return psycopg2.pool.ThreadedConnectionPool(
+        minconn=1,
+        maxconn=POOL_MAX_CONNECTIONS,
+        user=url.username,
+        password=url.password,
+        host=url.hostname,
+        port=url.port,
+        database=url.path[1:],
+        options=f'-c statement_timeout={int(STATEMENT_TIMEOUT_SECONDS * 1000)}',
+        **kwargs
+    )
 
 def init_pool():
     global db_pool
@@ -14,31 +155,240 @@ def init_pool():
         if not database_url:
             raise ValueError("DATABASE_URL environment variable is not set")
 
-        url = urlparse.urlparse(database_url)
-        db_pool = psycopg2.pool.SimpleConnectionPool(
-            minconn=1,
-            maxconn=10,
-            user=url.username,
-            password=url.password,
-            host=url.hostname,
-            port=url.port,
-            database=url.path[1:]
-        )
+        db_pool = make_pool(database_url, connection_factory=PrimaryConnection)
+
+def _with_query_timing(conn):
+    # Plain cursors unless this request is being profiled, so timing costs nothing otherwise
+    conn.cursor_factory = TimedCursor if _query_log.get() is not None else None
+    return conn
+
+def _with_query_budget(conn):
+    """Limits the connection's statements to what is left of the current query budget, if there is one."""
+    deadline = _query_deadline.get()
+    if deadline is None:
+        return conn
+    remaining_ms = int((deadline - time.monotonic()) * 1000)
+    try:
+        if remaining_ms <= 0:
+            raise QueryBudgetExceeded()
+        with conn.cursor() as cur:
+            if conn.autocommit:
+                # Replica connections have no transaction to scope SET LOCAL to; release_db_connection() resets this
+                cur.execute("SET statement_timeout = %s;", (remaining_ms,))
+                _session_timeouts.add(id(conn))
+            else:
+                # Lasts until this transaction ends; the pool rolls back whatever is open on release
+                cur.execute("SET LOCAL statement_timeout = %s;", (remaining_ms,))
+    except Exception:
+        release_db_connection(conn)
+        raise
+    if conn.cursor_factory is None:
+        conn.cursor_factory = BudgetedCursor
+    client = _client_socket.get()
+    if client is not None:
+        _watch(conn, client)
+    return conn
 
 def get_db_connection():
     if db_pool is None:
         init_pool()
-    return db_pool.getconn()
+    return _with_query_budget(_with_query_timing(db_pool.getconn()))
+
+def _get_replica_connection(index):
+    """A connection from replica `index`, or None if it is marked down or can't be reached."""
+    if time.monotonic() < _replica_down_until[index]:
+        return None
+    try:
+        with _replica_lock:
+            if replica_pools[index] is None:
+                replica_pools[index] = make_pool(REPLICA_DATABASE_URLS[index])
+            conn = replica_pools[index].getconn()
+        if conn.closed:
+            replica_pools[index].putconn(conn, close=True)
+            conn = replica_pools[index].getconn()
+        # Read-only guards against a write being routed here; autocommit keeps no transaction open on the standby
+        conn.set_session(readonly=True, autocommit=True)
+    except (psycopg2.Error, pool.PoolError):
+        _mark_replica_down(index)
+        return None
+    _replica_of_connection[id(conn)] = index
+    try:
+        return _with_query_budget(_with_query_timing(conn))
+    except psycopg2.OperationalError:
+        # Already released (and marked down if the connection broke); the next server is tried instead
+        return None
+
+def _mark_replica_down(index):
+    _replica_down_until[index] = time.monotonic() + REPLICA_RETRY_SECONDS
+
+def get_read_connection():
+    """
+    A connection for read-only queries. Uses the replicas round-robin when configured, unless reads
+    are pinned to the primary for this request; falls back to the primary if no replica is available.
+    """
+    if REPLICA_DATABASE_URLS and not _read_from_primary.get():
+        for _ in range(len(REPLICA_DATABASE_URLS)):
+            conn = _get_replica_connection(next(_next_replica) % len(REPLICA_DATABASE_URLS))
+            if conn is not None:
+                return conn
+    return get_db_connection()
 
 def release_db_connection(conn):
+    with _watch_lock:
+        _watched.pop(id(conn), None)
+    replica = _replica_of_connection.pop(id(conn), None)
+    if replica is not None:
+        # A connection that broke mid-query means the replica went away: stop routing to it for a while
+        if conn.closed:
+            _mark_replica_down(replica)
+        elif id(conn) in _session_timeouts:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("RESET statement_timeout;")
+            except psycopg2.Error:
+                conn.close()
+        _session_timeouts.discard(id(conn))
+        replica_pools[replica].putconn(conn, close=bool(conn.closed))
+        return
     if db_pool is not None:
         db_pool.putconn(conn)
 
+@contextlib.contextmanager
+def query_budget(seconds):
+    """
+    Gives every statement run inside the block (or decorated function) only the time left until
+    `seconds` from entering it, measured when the statement starts (see BudgetedCursor); Postgres cancels
+    a statement that runs past that. Nested budgets can only shorten the outer one. A statement that
+    would start with no time left raises QueryBudgetExceeded.
+    """
+    deadline = time.monotonic() + seconds
+    outer = _query_deadline.get()
+    token = _query_deadline.set(deadline if outer is None else min(outer, deadline))
+    try:
+        yield
+    finally:
+        _query_deadline.reset(token)
+
+def set_client_socket(client):
+    """The socket of the client this request serves; budgeted statements are cancelled if it disconnects."""
+    _client_socket.set(client)
+
+def _client_gone(client):
+    try:
+        # Peeking doesn't consume anything; an empty read means the client closed the connection
+        return client.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+    except BlockingIOError:
+        return False
+    except ValueError:
+        # TLS sockets don't support peeking; assume the client is still there
+        return False
+    except OSError:
+        return True
+
+def _watch(conn, client):
+    global _watch_thread
+    with _watch_lock:
+        _watched[id(conn)] = (conn, client)
+        if _watch_thread is None:
+            _watch_thread = threading.Thread(target=_watch_clients, name='query-watchdog', daemon=True)
+            _watch_thread.start()
+
+def _watch_clients():
+    """Cancels the running statement of budgeted connections whose client has gone away."""
+    while True:
+        time.sleep(DISCONNECT_CHECK_SECONDS)
+        with _watch_lock:
+            for key, (conn, client) in list(_watched.items()):
+                if _client_gone(client):
+                    # Under the lock, so the connection can't be released and reused before the cancel lands
+                    del _watched[key]
+                    try:
+                        conn.cancel()
+                    except psycopg2.Error:
+                        pass
+
+def open_listener_connection():
+    """A dedicated (unpooled) autocommit connection to the primary for LISTEN."""
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    return conn
+
+def notify_change(table, op='UPDATE'):
+    """Publishes a change event for data that lives outside the transactions table (e.g. the goals file)."""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_notify(%s, %s);", (CHANGE_CHANNEL, json.dumps({'table': table, 'op': op})))
+            conn.commit()
+    finally:
+        release_db_connection(conn)
+
+def begin_request(pin_reads_to_primary):
+    """Resets the per-request routing state. Pinned requests read from the primary only."""
+    _read_from_primary.set(pin_reads_to_primary)
+    _committed.set(False)
+
+def pin_reads_to_primary():
+    """Sends the rest of this request's reads to the primary, e.g. when they must match a counter read there."""
+    _read_from_primary.set(True)
+
+def committed_in_request():
+    """True if a primary transaction committed since begin_request()."""
+    return _committed.get()
+
+def start_query_log():
+    """Starts recording this context's statements; returns the list they are appended to."""
+    log = []
+    _query_log.set(log)
+    return log
+
+def stop_query_log():
+    _query_log.set(None)
+
+def register_statement(name, query):
+    """
+    Adds a statement to the registry under `name`, for execute_statement(). `query` uses %s placeholders
+    like any other query here. Registering a name again replaces it for connections that haven't prepared it yet,
+    so a name must always stand for the same statement. Returns the name.
+    """
+    if not _STATEMENT_NAME.match(name):
+        raise ValueError(f'Invalid statement name: {name!r}')
+    numbers = itertools.count(1)
+    _statements[name] = re.sub(r'%([s%])', lambda m: f'${next(numbers)}' if m.group(1) == 's' else '%', query)
+    return name
+
+def registered_statements():
+    """A copy of the registry: statement name -> query, with $n parameters as it is PREPAREd."""
+    return dict(_statements)
+
+def execute_statement(cur, name, params=()):
+    """
+    Runs the registered statement `name` with `params` on `cur`. The statement is PREPAREd the first time
+    its connection runs it and EXECUTEd by name from then on, so Postgres parses it once per connection
+    and can reuse its plan. Prepared statements outlive transactions and rollbacks; they last as long
+    as the pooled connection.
+    """
+    conn = cur.connection
+    with _prepared_lock:
+        prepared = _prepared.setdefault(conn, set())
+    if name not in prepared:
+        cur.execute(f"PREPARE {name} AS {_statements[name]}")
+        prepared.add(name)
+    if params:
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cur.execute(f"EXECUTE {name}")
+
 def init_db():
     """Initializes the database and creates tables if they don't exist."""
+    # Imported here: settings_manager registers its statements with this module when it is imported
+    import settings_manager
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
+            # Backfilling the derived tables below (first run only) can take a while on a big database
+            cur.execute("SET LOCAL statement_timeout = 0;")
+
             # User Table
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS users (
@@ -75,6 +425,12 @@ def init_db():
                 );
             """)
 
+            # Keyset pagination and date-range reports walk this index instead of sorting the table
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_transactions_date_id
+                ON transactions (date DESC, transaction_id DESC);
+            """)
+
             # Expense Categories Table
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS expense_categories (
@@ -101,14 +457,303 @@ def init_db():
                 );
             """)
 
+            # Data generation counters: bumped by a trigger on every write to transactions,
+            # so in-memory caches can tell whether they are stale with one cheap read.
+            # rewrite_generation only moves on UPDATE/DELETE, when appending new rows is not enough.
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS data_generation (
+                    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                    generation BIGINT NOT NULL DEFAULT 0,
+                    rewrite_generation BIGINT NOT NULL DEFAULT 0
+                );
+            """)
+            cur.execute("INSERT INTO data_generation (id) VALUES (TRUE) ON CONFLICT (id) DO NOTHING;")
+            cur.execute("""
+                CREATE OR REPLACE FUNCTION bump_data_generation() RETURNS trigger AS $$
+                DECLARE
+                    new_generation BIGINT;
+                BEGIN
+                    UPDATE data_generation SET
+                        generation = generation + 1,
+                        rewrite_generation = rewrite_generation + (CASE WHEN TG_OP = 'INSERT' THEN 0 ELSE 1 END)
+                    RETURNING generation INTO new_generation;
+                    -- Delivered to every listener when the transaction commits (see changefeed.py)
+                    PERFORM pg_notify(%s, json_build_object(
+                        'table', TG_TABLE_NAME, 'op', TG_OP, 'generation', new_generation
+                    )::text);
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql;
+            """, (CHANGE_CHANNEL,))
+            cur.execute("DROP TRIGGER IF EXISTS transactions_data_generation ON transactions;")
+            cur.execute("""
+                CREATE TRIGGER transactions_data_generation
+                AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON transactions
+                FOR EACH STATEMENT EXECUTE FUNCTION bump_data_generation();
+            """)
+
+            # Net change and row count per calendar month, kept current by the triggers below.
+            # The balance before any month is a sum over this small table, so a ledger page's
+            # running balance never has to add up the whole transaction history.
+            cur.execute("SELECT to_regclass('monthly_balances') IS NULL;")
+            backfill_monthly_balances = cur.fetchone()[0]
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS monthly_balances (
+                    month DATE PRIMARY KEY,
+                    net_change NUMERIC NOT NULL DEFAULT 0,
+                    transaction_count BIGINT NOT NULL DEFAULT 0
+                );
+            """)
+            cur.execute("""
+                CREATE OR REPLACE FUNCTION update_monthly_balances() RETURNS trigger AS $$
+                DECLARE
+                    changed_rows TEXT;
+                BEGIN
+                    IF TG_OP = 'TRUNCATE' THEN
+                        DELETE FROM monthly_balances;
+                        RETURN NULL;
+                    END IF;
+                    -- Transition tables only exist for the operations that define them
+                    changed_rows := CASE TG_OP
+                        WHEN 'INSERT' THEN 'SELECT date, type, amount, 1 AS sign FROM new_rows'
+                        WHEN 'DELETE' THEN 'SELECT date, type, amount, -1 AS sign FROM old_rows'
+                        ELSE 'SELECT date, type, amount, 1 AS sign FROM new_rows
+                              UNION ALL SELECT date, type, amount, -1 FROM old_rows'
+                    END;
+                    -- One upsert per month for the whole statement, in month order so that
+                    -- concurrent writers lock the rows in the same order
+                    EXECUTE 'INSERT INTO monthly_balances (month, net_change, transaction_count)
+                        SELECT date_trunc(''month'', date)::date,
+                               SUM(sign * CASE WHEN type = ''income'' THEN amount ELSE -amount END),
+                               SUM(sign)
+                        FROM (' || changed_rows || ') AS changed
+                        GROUP BY 1 ORDER BY 1
+                        ON CONFLICT (month) DO UPDATE SET
+                            net_change = monthly_balances.net_change + EXCLUDED.net_change,
+                            transaction_count = monthly_balances.transaction_count + EXCLUDED.transaction_count';
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql;
+            """)
+            for operation, transition in (('INSERT', 'NEW TABLE AS new_rows'),
+                                          ('DELETE', 'OLD TABLE AS old_rows'),
+                                          ('UPDATE', 'OLD TABLE AS old_rows NEW TABLE AS new_rows')):
+                trigger = f'transactions_monthly_balances_{operation.lower()}'
+                cur.execute(f"DROP TRIGGER IF EXISTS {trigger} ON transactions;")
+                cur.execute(f"""
+                    CREATE TRIGGER {trigger}
+                    AFTER {operation} ON transactions
+                    REFERENCING {transition}
+                    FOR EACH STATEMENT EXECUTE FUNCTION update_monthly_balances();
+                """)
+            cur.execute("DROP TRIGGER IF EXISTS transactions_monthly_balances_truncate ON transactions;")
+            cur.execute("""
+                CREATE TRIGGER transactions_monthly_balances_truncate
+                AFTER TRUNCATE ON transactions
+                FOR EACH STATEMENT EXECUTE FUNCTION update_monthly_balances();
+            """)
+            # Cold storage (see archive.py): rows of closed months live in gzip'd CSV chunk files, and only
+            # their per-month totals stay here. archive_chunks is the authoritative list of chunk files;
+            # the manifest.json next to them is rewritten from it.
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS archive_chunks (
+                    file TEXT PRIMARY KEY,
+                    month DATE NOT NULL,
+                    row_count INTEGER NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    archived_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                );
+            """)
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_archive_chunks_month ON archive_chunks (month);")
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS archived_totals (
+                    month DATE NOT NULL,
+                    type TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    item TEXT NOT NULL,
+                    savings_goal_id INTEGER NOT NULL DEFAULT 0,
+                    total NUMERIC NOT NULL,
+                    transaction_count INTEGER NOT NULL,
+                    first_date DATE NOT NULL,
+                    last_date DATE NOT NULL,
+                    PRIMARY KEY (month, type, category, item, savings_goal_id)
+                );
+            """)
+
+            # Item analytics (see budget.get_top_items()). Items are grouped by a normalized key, so "Brother "
+            # and "brother" are the same merchant; item_monthly_stats keeps each key's monthly totals, kept
+            # current by the triggers below, so top-N queries read a few rows per month instead of the ledger.
+            cur.execute(r"""
+                CREATE OR REPLACE FUNCTION normalize_item(item TEXT) RETURNS TEXT AS $$
+                    SELECT lower(btrim(regexp_replace(item, '\s+', ' ', 'g')));
+                $$ LANGUAGE SQL IMMUTABLE PARALLEL SAFE;
+            """)
+            cur.execute("SELECT to_regclass('item_monthly_stats') IS NULL;")
+            backfill_item_monthly_stats = cur.fetchone()[0]
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS item_monthly_stats (
+                    month DATE NOT NULL,
+                    type TEXT NOT NULL,
+                    item_key TEXT NOT NULL,
+                    item TEXT NOT NULL,
+                    total NUMERIC NOT NULL,
+                    transaction_count BIGINT NOT NULL,
+                    first_date DATE NOT NULL,
+                    last_date DATE NOT NULL,
+                    PRIMARY KEY (month, type, item_key)
+                );
+            """)
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_item_monthly_stats_key ON item_monthly_stats (type, item_key);")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_archived_totals_item_key ON archived_totals (type, normalize_item(item));")
+            cur.execute("""
+                CREATE OR REPLACE FUNCTION update_item_monthly_stats() RETURNS trigger AS $$
+                DECLARE
+                    affected TEXT;
+                BEGIN
+                    IF TG_OP = 'TRUNCATE' THEN
+                        DELETE FROM item_monthly_stats;
+                        RETURN NULL;
+                    END IF;
+                    IF TG_OP = 'INSERT' THEN
+                        -- New rows only add to the months they fall in
+                        INSERT INTO item_monthly_stats AS stats
+                            (month, type, item_key, item, total, transaction_count, first_date, last_date)
+                        SELECT date_trunc('month', date)::date, type, normalize_item(item), MIN(btrim(item)),
+                               SUM(amount), COUNT(*), MIN(date), MAX(date)
+                        FROM new_rows
+                        GROUP BY 1, 2, 3 ORDER BY 1, 2, 3
+                        ON CONFLICT (month, type, item_key) DO UPDATE SET
+                            total = stats.total + EXCLUDED.total,
+                            transaction_count = stats.transaction_count + EXCLUDED.transaction_count,
+                            first_date = LEAST(stats.first_date, EXCLUDED.first_date),
+                            last_date = GREATEST(stats.last_date, EXCLUDED.last_date);
+                        RETURN NULL;
+                    END IF;
+                    -- A removed row may have been a month's first or last, so the months and keys it
+                    -- touched are recounted from the ledger (one month of one item each)
+                    affected := 'SELECT DISTINCT date_trunc(''month'', date)::date AS month, type, normalize_item(item) AS item_key FROM '
+                        || CASE TG_OP
+                               WHEN 'DELETE' THEN 'old_rows'
+                               ELSE '(SELECT date, type, item FROM old_rows UNION ALL SELECT date, type, item FROM new_rows) AS changed'
+                           END;
+                    EXECUTE 'DELETE FROM item_monthly_stats AS stats USING (' || affected || ') AS affected
+                        WHERE stats.month = affected.month AND stats.type = affected.type AND stats.item_key = affected.item_key';
+                    EXECUTE 'INSERT INTO item_monthly_stats (month, type, item_key, item, total, transaction_count, first_date, last_date)
+                        SELECT affected.month, affected.type, affected.item_key, MIN(btrim(t.item)),
+                               SUM(t.amount), COUNT(*), MIN(t.date), MAX(t.date)
+                        FROM (' || affected || ') AS affected
+                        JOIN transactions AS t ON t.date >= affected.month
+                            AND t.date < (affected.month + interval ''1 month'')::date
+                            AND t.type = affected.type AND normalize_item(t.item) = affected.item_key
+                        GROUP BY 1, 2, 3 ORDER BY 1, 2, 3';
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql;
+            """)
+            for operation, transition in (('INSERT', 'NEW TABLE AS new_rows'),
+                                          ('DELETE', 'OLD TABLE AS old_rows'),
+                                          ('UPDATE', 'OLD TABLE AS old_rows NEW TABLE AS new_rows')):
+                trigger = f'transactions_item_stats_{operation.lower()}'
+                cur.execute(f"DROP TRIGGER IF EXISTS {trigger} ON transactions;")
+                cur.execute(f"""
+                    CREATE TRIGGER {trigger}
+                    AFTER {operation} ON transactions
+                    REFERENCING {transition}
+                    FOR EACH STATEMENT EXECUTE FUNCTION update_item_monthly_stats();
+                """)
+            cur.execute("DROP TRIGGER IF EXISTS transactions_item_stats_truncate ON transactions;")
+            cur.execute("""
+                CREATE TRIGGER transactions_item_stats_truncate
+                AFTER TRUNCATE ON transactions
+                FOR EACH STATEMENT EXECUTE FUNCTION update_item_monthly_stats();
+            """)
+
+            # Recurring transactions (see recurring.py). materialized_through is the date up to which a rule's
+            # transactions have been created; recurring_occurrences records each (rule, date) created, so
+            # overlapping scheduler runs can never create the same occurrence twice.
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS recurring_rules (
+                    id SERIAL PRIMARY KEY,
+                    type TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    item TEXT NOT NULL,
+                    amount NUMERIC NOT NULL,
+                    description TEXT,
+                    savings_goal_id INTEGER REFERENCES savings_goals(id) ON DELETE SET NULL,
+                    cadence TEXT NOT NULL,
+                    start_date DATE NOT NULL,
+                    end_date DATE,
+                    active BOOLEAN NOT NULL DEFAULT TRUE,
+                    materialized_through DATE
+                );
+            """)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS recurring_occurrences (
+                    rule_id INTEGER NOT NULL REFERENCES recurring_rules(id) ON DELETE CASCADE,
+                    occurrence_date DATE NOT NULL,
+                    PRIMARY KEY (rule_id, occurrence_date)
+                );
+            """)
+
+            # Only the run that creates a table fills it from the rows written before its triggers existed;
+            # after that the triggers keep it current (python db.py --rebuild-checkpoints recomputes them)
+            if backfill_monthly_balances:
+                _rebuild_monthly_balances(cur)
+            if backfill_item_monthly_stats:
+                _rebuild_item_monthly_stats(cur)
+
             conn.commit()
             # Initialize default settings after tables are created
             settings_manager.initialize_default_settings() # Added call
     finally:
         release_db_connection(conn)
 
+def _rebuild_monthly_balances(cur):
+    """Recomputes monthly_balances from the ledger. Writers to transactions wait until the caller commits."""
+    cur.execute("LOCK TABLE transactions IN SHARE MODE;")
+    cur.execute("DELETE FROM monthly_balances;")
+    cur.execute("""
+        INSERT INTO monthly_balances (month, net_change, transaction_count)
+        SELECT date_trunc('month', date)::date,
+               SUM(CASE WHEN type = 'income' THEN amount ELSE -amount END),
+               COUNT(*)
+        FROM transactions
+        GROUP BY 1;
+    """)
+
+def _rebuild_item_monthly_stats(cur):
+    """Recomputes item_monthly_stats from the ledger. Writers to transactions wait until the caller commits."""
+    cur.execute("LOCK TABLE transactions IN SHARE MODE;")
+    cur.execute("DELETE FROM item_monthly_stats;")
+    cur.execute("""
+        INSERT INTO item_monthly_stats (month, type, item_key, item, total, transaction_count, first_date, last_date)
+        SELECT date_trunc('month', date)::date, type, normalize_item(item), MIN(btrim(item)),
+               SUM(amount), COUNT(*), MIN(date), MAX(date)
+        FROM transactions
+        GROUP BY 1, 2, 3;
+    """)
+
+def rebuild_checkpoints():
+    """
+    Recomputes the trigger-maintained summary tables from the ledger, for when rows reached the
+    transactions table with its triggers disabled (e.g. a bulk load with session_replication_role = replica).
+    """
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL statement_timeout = 0;")
+            _rebuild_monthly_balances(cur)
+            _rebuild_item_monthly_stats(cur)
+        conn.commit()
+    finally:
+        release_db_connection(conn)
+
 if __name__ == '__main__':
     # This allows you to run `python db.py` to initialize the database manually.
     print("Initializing database...")
     init_db()
     print("Database initialization complete.")
+    if '--rebuild-checkpoints' in sys.argv[1:]:
+        print("Rebuilding checkpoints...")
+        rebuild_checkpoints()
+        print("Checkpoints rebuilt.")
@@ -0,0 +1,159 @@
+import math
+import threading
+from datetime import date
+import numpy as np
+import analytics
+
+HISTORY_MONTHS = 36       # complete months of history the forecast looks at
+RECENT_MONTHS = 6         # window for the baseline level and goal contribution rates
+SEASONAL_MIN_MONTHS = 24  # need two of each calendar month before trusting a seasonal index
+RECURRING_SHARE = 0.8     # a category present in this share of recent months is treated as a fixed bill
+OUTLIER_FACTOR = 3        # months above this multiple of the median are clipped for the seasonal index
+HORIZON_MONTHS = 12
+MAX_CACHED_FORECASTS = 32
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _category_forecast(history, first_month, current_month, horizon):
+    """
+    Projects every category at once from a (months, categories) matrix of complete-month totals.
+
+    Each category gets a level, scaled by a calendar-month seasonal index when there is enough
+    history. The level is the mean of the recent months, or their median for categories that show
+    up almost every month (recurring bills and pay), so one odd month doesn't skew a fixed amount.
+    Returns (forecast (horizon, categories), pattern names per category).
+    """
+    month_count, category_count = history.shape
+    if month_count == 0 or category_count == 0:
+        return np.zeros((horizon, category_count)), ['average'] * category_count
+
+    recent = history[-RECENT_MONTHS:]
+    level = recent.mean(axis=0)
+
+    recurring = (history[-12:] > 0).mean(axis=0) >= RECURRING_SHARE
+    median = np.median(recent, axis=0)
+
+    calendar = (first_month + np.arange(month_count)) % 12
+    target_calendar = (current_month + np.arange(horizon)) % 12
+    seasonal = np.ones((12, category_count))
+    use_seasonal = month_count >= SEASONAL_MIN_MONTHS
+    if use_seasonal:
+        # Clip one-off spikes so a single big purchase doesn't read as a seasonal pattern
+        typical = np.median(history, axis=0)
+        clipped = np.where(typical > 0, np.minimum(history, OUTLIER_FACTOR * typical), history)
+        sums = np.zeros((12, category_count))
+        np.add.at(sums, calendar, clipped)
+        counts = np.bincount(calendar, minlength=12)[:, None]
+        calendar_mean = sums / np.maximum(counts, 1)
+        overall_mean = clipped.mean(axis=0)
+        np.divide(calendar_mean, overall_mean, out=seasonal, where=overall_mean > 0)
+
+    forecast = np.where(recurring, median, level) * seasonal[target_calendar]
+    patterns = [
+        ('recurring' if is_recurring else 'average') + (' (seasonal)' if use_seasonal else '')
+        for is_recurring in recurring
+    ]
+    return forecast, patterns
+
+
+def _goal_etas(snapshot, goals, current_month, monthly_savings_goal):
+    """Months until each goal's target at its recent contribution rate (and at the planned monthly savings goal)."""
+    numeric_goals = [goal for goal in goals if str(goal.get('id', '')).isdigit()]
+    rates = np.zeros(len(numeric_goals))
+    if numeric_goals:
+        contributions = snapshot.goal_matrix(current_month - RECENT_MONTHS, current_month - 1,
+                                             [int(goal['id']) for goal in numeric_goals])
+        rates = contributions.mean(axis=0) / 100
+
+    etas = {}
+    for goal, rate in zip(numeric_goals, rates):
+        remaining = float(goal['target_amount']) - float(goal['saved_amount'])
+        eta = {'monthly_rate': round(float(rate), 2), 'remaining': round(max(remaining, 0), 2),
+               'reached': remaining <= 0, 'eta': None, 'months_to_go': None, 'planned_eta': None}
+        if remaining > 0 and rate > 0:
+            months_to_go = math.ceil(remaining / rate)
+            eta['months_to_go'] = months_to_go
+            eta['eta'] = analytics.month_label(current_month + months_to_go)
+        if remaining > 0 and monthly_savings_goal > 0:
+            eta['planned_eta'] = analytics.month_label(current_month + math.ceil(remaining / monthly_savings_goal))
+        etas[str(goal['id'])] = eta
+    return etas
+
+
+def _build_forecast(snapshot, today, goals, monthly_savings_goal, horizon):
+    current_month = analytics.month_index(today.year, today.month)
+    first_month = current_month - HISTORY_MONTHS
+
+    projected = {}
+    categories = []
+    history_months = 0
+    for transaction_type in ('income', 'expense'):
+        names, history = snapshot.category_matrix(first_month, current_month, transaction_type)
+        history = history / 100
+        month_to_date = history[-1]
+        history = history[:-1]
+        projected[transaction_type] = (names, history, month_to_date)
+
+    # Drop the leading months before the first transaction so a new user's history isn't padded with zeros
+    active = projected['income'][1].any(axis=1) | projected['expense'][1].any(axis=1)
+    if active.any():
+        start = int(np.argmax(active))
+        history_months = HISTORY_MONTHS - start
+    else:
+        start = HISTORY_MONTHS
+
+    totals = {}
+    for transaction_type, (names, history, month_to_date) in projected.items():
+        forecast, patterns = _category_forecast(history[start:], first_month + start, current_month, horizon)
+        # The current month is partly over: only what is still expected on top of month-to-date is left to come
+        if horizon:
+            forecast[0] = np.maximum(forecast[0] - month_to_date, 0)
+        totals[transaction_type] = forecast.sum(axis=1)
+        typical_month = forecast[1:].mean(axis=0) if horizon > 1 else forecast.sum(axis=0)
+        for name, pattern, monthly in zip(names, patterns, typical_month):
+            if monthly > 0:
+                categories.append({'type': transaction_type, 'category': name,
+                                   'pattern': pattern, 'monthly': round(float(monthly), 2)})
+
+    net = totals['income'] - totals['expense']
+    balance = snapshot.balance() / 100 + np.cumsum(net)
+    categories.sort(key=lambda row: row['monthly'], reverse=True)
+
+    return {
+        'months': [analytics.month_label(current_month + i) for i in range(horizon)],
+        'income': totals['income'].round(2).tolist(),
+        'expense': totals['expense'].round(2).tolist(),
+        'net': net.round(2).tolist(),
+        'balance': balance.round(2).tolist(),
+        'categories': categories,
+        'goals': _goal_etas(snapshot, goals, current_month, monthly_savings_goal),
+        'history_months': history_months,
+    }
+
+
+def get_forecast(goals, monthly_savings_goal=0, horizon=HORIZON_MONTHS, today=None):
+    """
+    Projected income, expense and end-of-month balance for the current month and the next
+    horizon-1 months, per-category patterns, and an ETA for every savings goal.
+
+    Results are cached per (data generation, month, goals, savings goal) so repeat page loads
+    do no work until a transaction changes.
+    """
+    today = today or date.today()
+    snapshot = analytics.get_snapshot()
+    goals_key = tuple((str(g.get('id')), float(g['target_amount']), float(g['saved_amount'])) for g in goals)
+    key = (snapshot.generation, today.year, today.month, goals_key, float(monthly_savings_goal or 0), horizon)
+
+    with _cache_lock:
+        cached = _cache.get(key)
+    if cached is not None:
+        return cached
+
+    result = _build_forecast(snapshot, today, goals, float(monthly_savings_goal or 0), horizon)
+    with _cache_lock:
+        if len(_cache) >= MAX_CACHED_FORECASTS:
+            _cache.clear()
+        _cache[key] = result
+    return result
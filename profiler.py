@@ -0,0 +1,208 @@
+import contextvars
+import os
+import secrets
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from flask import before_render_template, template_rendered
+import db
+
+# Request switches: ?_profile=1 or an "X-Profile: 1" header (honoured for admins only, see app.py)
+PROFILE_PARAM = '_profile'
+PROFILE_HEADER = 'X-Profile'
+# How often the sampler looks at the request thread's stack
+SAMPLE_INTERVAL_SECONDS = float(os.environ.get('PROFILE_SAMPLE_MS', 2)) / 1000
+# Finished profiles kept per worker process; the oldest are dropped first
+MAX_PROFILES = int(os.environ.get('PROFILE_HISTORY', 20))
+# Rows shown in each of the function and query tables
+TOP_ENTRIES = 40
+
+APP_DIR = os.path.abspath(os.path.dirname(__file__))
+
+_current = contextvars.ContextVar('profile', default=None)
+_profiles = deque(maxlen=MAX_PROFILES)
+_profiles_lock = threading.Lock()
+
+
+def _frame_label(code):
+    """'function (file:line)' with paths shortened to the app directory or the installed package."""
+    filename = code.co_filename
+    if filename.startswith(APP_DIR):
+        filename = os.path.relpath(filename, APP_DIR)
+    elif 'site-packages' in filename:
+        filename = filename.split('site-packages' + os.sep, 1)[-1]
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'
+
+
+class Sampler(threading.Thread):
+    """Records the call stack of one thread every `interval` seconds until stopped."""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL_SECONDS):
+        super().__init__(name='profiler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        labels = {}
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                label = labels.get(code)
+                if label is None:
+                    label = labels[code] = _frame_label(code)
+                stack.append(label)
+                frame = frame.f_back
+            if stack:
+                stack.reverse()
+                self.stacks[tuple(stack)] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+class Profile:
+    """One profiled request: sampled stacks, the statements it ran and the templates it rendered."""
+
+    def __init__(self, method, path, username):
+        self.id = secrets.token_hex(6)
+        self.method = method
+        self.path = path
+        self.username = username
+        self.started_at = datetime.now()
+        self.status = None
+        self.total_ms = None
+        self.templates = []     # (name, milliseconds, nesting depth), in the order they finished
+        self._template_starts = []
+        self._queries = db.start_query_log()
+        self._sampler = Sampler(threading.get_ident())
+        self._start = time.perf_counter()
+        self._sampler.start()
+
+    def finish(self, status):
+        self.total_ms = (time.perf_counter() - self._start) * 1000
+        self._sampler.stop()
+        db.stop_query_log()
+        self.status = status
+
+    @property
+    def sample_interval_ms(self):
+        return self._sampler.interval * 1000
+
+    @property
+    def samples(self):
+        return sum(self._sampler.stacks.values())
+
+    @property
+    def query_ms(self):
+        return sum(seconds for _, seconds, _ in self._queries) * 1000
+
+    @property
+    def query_count(self):
+        return len(self._queries)
+
+    @property
+    def template_ms(self):
+        # Only top-level renders, so a template rendered from inside another isn't counted twice
+        return sum(ms for name, ms, depth in self.templates if depth == 0)
+
+    def functions(self):
+        """
+        Functions by samples spent in them (self) and anywhere below them (total).
+        Hottest self time first: the outer framework frames share every sample and would otherwise lead.
+        """
+        own = Counter()
+        total = Counter()
+        for stack, count in self._sampler.stacks.items():
+            own[stack[-1]] += count
+            for label in set(stack):
+                total[label] += count
+        busiest = sorted(total, key=lambda label: (own[label], total[label]), reverse=True)[:TOP_ENTRIES]
+        return [{'function': label, 'self': own[label], 'total': total[label]} for label in busiest]
+
+    def queries(self):
+        """Statements grouped by text, slowest total first."""
+        grouped = {}
+        for statement, seconds, rows in self._queries:
+            entry = grouped.setdefault(statement, {'statement': statement, 'calls': 0, 'total_ms': 0.0,
+                                                   'max_ms': 0.0, 'rows': 0})
+            entry['calls'] += 1
+            entry['total_ms'] += seconds * 1000
+            entry['max_ms'] = max(entry['max_ms'], seconds * 1000)
+            entry['rows'] += max(rows, 0)
+        return sorted(grouped.values(), key=lambda entry: entry['total_ms'], reverse=True)
+
+    def collapsed_stacks(self):
+        """Stacks in the 'frame;frame;frame count' format flame graph tools read."""
+        return [f"{';'.join(stack)} {count}" for stack, count in self._sampler.stacks.most_common()]
+
+    def server_timing(self):
+        return (f'total;dur={self.total_ms:.1f}, db;dur={self.query_ms:.1f};desc="{self.query_count} queries", '
+                f'tpl;dur={self.template_ms:.1f}')
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'method': self.method,
+            'path': self.path,
+            'user': self.username,
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'status': self.status,
+            'total_ms': round(self.total_ms, 2),
+            'sample_interval_ms': self.sample_interval_ms,
+            'samples': self.samples,
+            'query_ms': round(self.query_ms, 2),
+            'queries': self.queries(),
+            'template_ms': round(self.template_ms, 2),
+            'templates': [{'template': name, 'ms': round(ms, 2), 'depth': depth} for name, ms, depth in self.templates],
+            'functions': self.functions(),
+            'stacks': self.collapsed_stacks(),
+        }
+
+
+def start(method, path, username):
+    """Starts profiling the current request."""
+    profile = Profile(method, path, username)
+    _current.set(profile)
+    return profile
+
+
+def finish(profile, status):
+    """Stops `profile` and adds it to the recent profiles."""
+    _current.set(None)
+    profile.finish(status)
+    with _profiles_lock:
+        _profiles.append(profile)
+
+
+def recent_profiles():
+    """Kept profiles, newest first."""
+    with _profiles_lock:
+        return list(reversed(_profiles))
+
+
+def get_profile(profile_id):
+    with _profiles_lock:
+        return next((profile for profile in _profiles if profile.id == profile_id), None)
+
+
+@before_render_template.connect
+def _template_started(sender, template, context, **extra):
+    profile = _current.get()
+    if profile is not None:
+        profile._template_starts.append(time.perf_counter())
+
+
+@template_rendered.connect
+def _template_finished(sender, template, context, **extra):
+    profile = _current.get()
+    if profile is not None and profile._template_starts:
+        started = profile._template_starts.pop()
+        profile.templates.append((template.name, (time.perf_counter() - started) * 1000,
+                                  len(profile._template_starts)))
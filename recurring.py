@@ -0,0 +1,225 @@
+import argparse
+import calendar
+import logging
+import os
+import threading
+import time
+from datetime import date, timedelta
+from psycopg2.extras import execute_values
+import archive
+import budget
+import db
+import savings_goals
+
+CADENCES = ('weekly', 'biweekly', 'monthly', 'quarterly', 'yearly')
+CADENCE_MONTHS = {'monthly': 1, 'quarterly': 3, 'yearly': 12}
+CADENCE_WEEKS = {'weekly': 1, 'biweekly': 2}
+# How often each worker's scheduler thread materializes due occurrences; 0 leaves it to the CLI tick
+TICK_SECONDS = float(os.environ.get('RECURRING_TICK_SECONDS', 3600))
+
+RULE_COLUMNS = ('id', 'type', 'category', 'item', 'amount', 'description', 'savings_goal_id',
+                'cadence', 'start_date', 'end_date', 'active', 'materialized_through')
+
+# One statement per run: claim the (rule, occurrence date) pairs that aren't in the ledger yet and insert
+# a transaction for each claimed one. Pairs another run already claimed are skipped by ON CONFLICT.
+MATERIALIZE_QUERY = """
+    WITH due (rule_id, occurrence_date) AS (VALUES %s),
+    claimed AS (
+        INSERT INTO recurring_occurrences (rule_id, occurrence_date)
+        SELECT rule_id, occurrence_date FROM due
+        ON CONFLICT (rule_id, occurrence_date) DO NOTHING
+        RETURNING rule_id, occurrence_date
+    )
+    INSERT INTO transactions (date, type, category, item, amount, description, savings_goal_id)
+    SELECT claimed.occurrence_date, rule.type, rule.category, rule.item, rule.amount, rule.description, rule.savings_goal_id
+    FROM claimed JOIN recurring_rules AS rule ON rule.id = claimed.rule_id
+    ORDER BY claimed.occurrence_date, rule.id
+    RETURNING type, category, amount, savings_goal_id;
+"""
+
+_scheduler_thread = None
+_scheduler_lock = threading.Lock()
+logger = logging.getLogger(__name__)
+
+
+def occurrence(cadence, start_date, n):
+    """The n-th occurrence (0 = start_date) of a rule. Monthly dates past the end of a shorter month use its last day."""
+    if cadence in CADENCE_WEEKS:
+        return start_date + timedelta(weeks=CADENCE_WEEKS[cadence] * n)
+    year, index = divmod(start_date.year * 12 + start_date.month - 1 + CADENCE_MONTHS[cadence] * n, 12)
+    return date(year, index + 1, min(start_date.day, calendar.monthrange(year, index + 1)[1]))
+
+
+def occurrence_dates(cadence, start_date, after, through):
+    """Occurrence dates of a rule later than `after` (None: from the start) and no later than `through`."""
+    dates = []
+    n = 0
+    day = start_date
+    while day <= through:
+        if after is None or day > after:
+            dates.append(day)
+        n += 1
+        day = occurrence(cadence, start_date, n)
+    return dates
+
+
+def next_occurrence(rule):
+    """The first occurrence of a rule that hasn't been materialized yet, or None if it has ended."""
+    after = rule['materialized_through']
+    n = 0
+    day = rule['start_date']
+    while after is not None and day <= after:
+        n += 1
+        day = occurrence(rule['cadence'], rule['start_date'], n)
+    if rule['end_date'] and day > rule['end_date']:
+        return None
+    return day
+
+
+def get_rules():
+    """All recurring rules as dicts, with the date each one next produces a transaction."""
+    conn = db.get_read_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT {', '.join(RULE_COLUMNS)} FROM recurring_rules ORDER BY type DESC, category, item, id;")
+            rules = [dict(zip(RULE_COLUMNS, row)) for row in cur.fetchall()]
+    finally:
+        db.release_db_connection(conn)
+    for rule in rules:
+        rule['next_occurrence'] = next_occurrence(rule)
+    return rules
+
+
+def add_rule(row, cadence, end_date=None):
+    """Adds a rule from a row validated by budget.validate_transaction_rows(); its date is the first occurrence."""
+    conn = db.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO recurring_rules (type, category, item, amount, description, savings_goal_id, "
+                "cadence, start_date, end_date) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id;",
+                (row['type'], row['category'], row['item'], row['amount'], row['description'],
+                 int(row['savings_goal_id']) if row.get('savings_goal_id') else None,
+                 cadence, row['date'], end_date)
+            )
+            rule_id = cur.fetchone()[0]
+            conn.commit()
+    finally:
+        db.release_db_connection(conn)
+    return rule_id
+
+
+def set_rule_active(rule_id, active):
+    """
+    Pauses or resumes a rule. Resuming skips the occurrences that fell due while it was paused,
+    rather than backfilling them on the next tick.
+    """
+    conn = db.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE recurring_rules SET active = %s, "
+                "materialized_through = CASE WHEN %s THEN GREATEST(materialized_through, CURRENT_DATE - 1) "
+                "ELSE materialized_through END WHERE id = %s;",
+                (active, active, rule_id)
+            )
+            conn.commit()
+    finally:
+        db.release_db_connection(conn)
+
+
+def delete_rule(rule_id):
+    """Deletes a rule. The transactions it already created stay in the ledger."""
+    conn = db.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM recurring_rules WHERE id = %s;", (rule_id,))
+            conn.commit()
+    finally:
+        db.release_db_connection(conn)
+
+
+def materialize_due(through=None):
+    """
+    Inserts the transactions of every active rule's occurrences up to `through` (default today) that
+    haven't been created yet: missed periods after downtime and the backfill of a rule starting in the past
+    included. All of it happens in one database transaction with one multi-row insert, and running it again
+    (or from several workers at once) adds nothing twice. Savings goals that received any of them are then
+    recomputed from the ledger. Returns the number of transactions inserted.
+    """
+    through = through or date.today()
+    conn = db.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            # Concurrent runs wait on these row locks, then find the rules already materialized and skip them
+            cur.execute(
+                "SELECT id, cadence, start_date, end_date, materialized_through FROM recurring_rules "
+                "WHERE active AND start_date <= %s AND (materialized_through IS NULL OR materialized_through < %s) "
+                "ORDER BY id FOR UPDATE;",
+                (through, through)
+            )
+            rules = cur.fetchall()
+            due = [
+                (rule_id, day)
+                for rule_id, cadence, start_date, end_date, materialized_through in rules
+                for day in occurrence_dates(cadence, start_date, materialized_through,
+                                            min(through, end_date) if end_date else through)
+            ]
+            inserted = []
+            if due:
+                inserted = execute_values(cur, MATERIALIZE_QUERY, due, template='(%s::integer, %s::date)',
+                                          page_size=len(due), fetch=True)
+            if rules:
+                cur.execute("UPDATE recurring_rules SET materialized_through = %s WHERE id = ANY(%s);",
+                            (through, [rule[0] for rule in rules]))
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db.release_db_connection(conn)
+
+    increments = savings_goals.aggregate_goal_increments(
+        {'type': row_type, 'category': category, 'amount': amount, 'savings_goal_id': savings_goal_id}
+        for row_type, category, amount, savings_goal_id in inserted
+    )
+    if increments:
+        # Recomputed rather than incremented: the transactions are already committed, so a goals file
+        # write that fails here is made good by the next recompute instead of being lost
+        savings_goals.recalculate_saved_amounts(budget.get_transactions(sort_by_date=False),
+                                                archive.goal_savings_totals())
+    return len(inserted)
+
+
+def start_scheduler():
+    """
+    Starts this process's scheduler thread, once. It catches up right away and then every TICK_SECONDS.
+    Called from a request hook, so each gunicorn worker starts its own after forking.
+    """
+    global _scheduler_thread
+    if TICK_SECONDS <= 0 or _scheduler_thread is not None:
+        return
+    with _scheduler_lock:
+        if _scheduler_thread is None:
+            _scheduler_thread = threading.Thread(target=_run_scheduler, name='recurring', daemon=True)
+            _scheduler_thread.start()
+
+
+def _run_scheduler():
+    while True:
+        try:
+            materialize_due()
+        except Exception:
+            # Occurrences are claimed in the same transaction as their rows, so whatever didn't commit is
+            # picked up by the next tick; goal totals catch up on the next recompute (see materialize_due())
+            logger.exception("Materializing recurring transactions failed")
+        time.sleep(TICK_SECONDS)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create the transactions of recurring rules that are due.')
+    parser.add_argument('--through', type=date.fromisoformat, default=None,
+                        help='materialize occurrences up to this date (default: today)')
+    args = parser.parse_args()
+    count = materialize_due(args.through)
+    print(f"Created {count} recurring transactions through {args.through or date.today()}")
@@ -0,0 +1,266 @@
+import os
+import threading
+from collections import OrderedDict
+from fpdf import FPDF
+from fpdf.enums import XPos, YPos
+
+# Total size of generated PDFs kept in memory per process; least recently downloaded go first
+PDF_CACHE_BYTES = int(os.environ.get('PDF_CACHE_BYTES', 32 * 1024 * 1024))
+
+MARGIN = 10
+GREEN = (0, 128, 0)
+RED = (200, 0, 0)
+BLUE = (13, 110, 253)
+PURPLE = (111, 66, 193)
+ORANGE = (253, 126, 20)
+HEADING_FILL = (200, 200, 200)
+STRIPE_FILL = (245, 245, 245)
+CHART_COLORS = [
+    (13, 110, 253), (102, 16, 242), (111, 66, 193), (214, 51, 132), (220, 53, 69),
+    (253, 126, 20), (255, 193, 7), (25, 135, 84), (32, 201, 151), (13, 202, 240),
+]
+
+_cache = OrderedDict()
+_cache_bytes = 0
+_cache_lock = threading.Lock()
+
+
+def get_cached_pdf(key):
+    with _cache_lock:
+        pdf = _cache.get(key)
+        if pdf is not None:
+            _cache.move_to_end(key)
+        return pdf
+
+
+def cache_pdf(key, pdf):
+    global _cache_bytes
+    if len(pdf) > PDF_CACHE_BYTES:
+        return
+    with _cache_lock:
+        if key in _cache:
+            return
+        _cache[key] = pdf
+        _cache_bytes += len(pdf)
+        while _cache_bytes > PDF_CACHE_BYTES:
+            _, evicted = _cache.popitem(last=False)
+            _cache_bytes -= len(evicted)
+
+
+def _text(value):
+    # The built-in PDF fonts only cover Latin-1
+    return str(value if value is not None else '').encode('latin-1', 'replace').decode('latin-1')
+
+
+def _money(value):
+    return f'${float(value or 0):,.2f}'
+
+
+class ReportPDF(FPDF):
+    def footer(self):
+        self.set_y(-MARGIN)
+        self.set_font('Helvetica', '', 8)
+        self.set_text_color(120, 120, 120)
+        self.cell(0, 5, f'Page {self.page_no()}/{{nb}}', align='C')
+
+
+def _stat_row(pdf, stats):
+    """A row of centered label/amount boxes."""
+    width = (pdf.w - 2 * MARGIN) / len(stats)
+    y = pdf.get_y()
+    for i, (label, amount, color) in enumerate(stats):
+        pdf.set_xy(MARGIN + i * width, y)
+        pdf.set_font('Helvetica', 'B', 10)
+        pdf.set_text_color(0, 0, 0)
+        pdf.cell(width, 6, label, align='C')
+        pdf.set_xy(MARGIN + i * width, y + 6)
+        pdf.set_font('Helvetica', 'B', 13)
+        pdf.set_text_color(*color)
+        pdf.cell(width, 8, _money(amount), align='C')
+    pdf.set_text_color(0, 0, 0)
+    pdf.set_xy(MARGIN, y + 18)
+
+
+def _section_title(pdf, title):
+    pdf.set_font('Helvetica', 'B', 13)
+    pdf.set_text_color(0, 0, 0)
+    pdf.cell(0, 10, title, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+
+
+def _expense_pie(pdf, breakdown, diameter=70):
+    """Top 10 expense categories as vector pie slices with a legend beside them."""
+    slices = sorted(((c, float(a)) for c, a in breakdown.items() if float(a) > 0), key=lambda s: s[1], reverse=True)[:10]
+    total = sum(amount for _, amount in slices)
+    if not slices:
+        pdf.set_font('Helvetica', 'I', 10)
+        pdf.cell(0, 8, 'No expense data to display for this period.', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        return
+
+    if pdf.get_y() + diameter > pdf.h - 2 * MARGIN:
+        pdf.add_page()
+    top = pdf.get_y()
+    angle = 90.0
+    pdf.set_draw_color(255, 255, 255)
+    for i, (_, amount) in enumerate(slices):
+        sweep = 360.0 * amount / total
+        pdf.set_fill_color(*CHART_COLORS[i % len(CHART_COLORS)])
+        if sweep >= 359.99:
+            pdf.ellipse(MARGIN, top, diameter, diameter, style='F')
+        else:
+            pdf.solid_arc(MARGIN, top, diameter, angle - sweep, angle, style='FD')
+        angle -= sweep
+
+    legend_x = MARGIN + diameter + 10
+    pdf.set_font('Helvetica', '', 9)
+    for i, (category, amount) in enumerate(slices):
+        y = top + 4 + i * 6.5
+        pdf.set_fill_color(*CHART_COLORS[i % len(CHART_COLORS)])
+        pdf.rect(legend_x, y + 1, 4, 4, style='F')
+        pdf.set_xy(legend_x + 6, y)
+        pdf.cell(0, 6, _text(f'{category}: {_money(amount)} ({100 * amount / total:.1f}%)'))
+    pdf.set_draw_color(0, 0, 0)
+    pdf.set_xy(MARGIN, top + diameter + 5)
+
+
+def _fit(pdf, text, width):
+    """Text shortened with an ellipsis so it fits on one line of the given cell width."""
+    text = _text(text)
+    width -= 2 * pdf.c_margin
+    if pdf.get_string_width(text) <= width:
+        return text
+    # Binary search for the longest prefix that fits with the ellipsis: O(log n) measurements, not O(n)
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if pdf.get_string_width(text[:middle] + '...') <= width:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low] + '...'
+
+
+def _table(pdf, headings, rows, col_widths, align, amount_colors=None, line_height=5):
+    """
+    A striped table of single-line rows whose headings repeat on every page.
+    amount_colors gives a per-row text color for the last column.
+    Drawn cell by cell: fpdf2's table() lays out every cell as a text region and is far slower for long reports.
+    """
+    def headings_row():
+        pdf.set_font('Helvetica', 'B', 8)
+        pdf.set_fill_color(*HEADING_FILL)
+        for text, width, alignment in zip(headings, col_widths, align):
+            pdf.cell(width, line_height + 1, text, align=alignment, fill=True)
+        pdf.ln(line_height + 1)
+        pdf.set_font('Helvetica', '', 8)
+
+    headings_row()
+    pdf.set_fill_color(*STRIPE_FILL)
+    last = len(col_widths) - 1
+    for i, values in enumerate(rows):
+        if pdf.get_y() + line_height > pdf.page_break_trigger:
+            pdf.add_page()
+            headings_row()
+            pdf.set_fill_color(*STRIPE_FILL)
+        fill = i % 2 == 1
+        for j, (value, width, alignment) in enumerate(zip(values, col_widths, align)):
+            if amount_colors and j == last:
+                pdf.set_text_color(*amount_colors[i])
+            pdf.cell(width, line_height, _fit(pdf, value, width), align=alignment, fill=fill)
+        pdf.set_text_color(0, 0, 0)
+        pdf.ln(line_height)
+    pdf.ln(3)
+
+
+def _change(change, percent):
+    sign = '+' if change > 0 else ('-' if change < 0 else '')
+    text = f'{sign}{_money(abs(change))}'
+    if percent is not None:
+        text += f' ({percent:+.1f}%)'
+    return text
+
+
+def _comparison(pdf, comparison):
+    """Totals, categories and their items against the previous period and the same period a year earlier."""
+    ranges = comparison['ranges']
+    pdf.set_font('Helvetica', '', 9)
+    pdf.cell(0, 5, _text(
+        f"Previous period: {ranges['previous']['start_date']} to {ranges['previous']['end_date']}.  "
+        f"Year ago: {ranges['year_ago']['start_date']} to {ranges['year_ago']['end_date']}."
+    ), new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.ln(2)
+
+    def row(label, amounts):
+        return (label, _money(amounts['current']), _money(amounts['previous']),
+                _change(amounts['change_previous'], amounts['percent_previous']),
+                _money(amounts['year_ago']), _change(amounts['change_year'], amounts['percent_year']))
+
+    rows = [row(totals['label'], totals) for totals in comparison['totals']]
+    for category in comparison['categories']:
+        rows.append(row(f"{category['category']} ({category['type']})", category))
+        rows.extend(row(f"    {item['item']}", item) for item in category['items'])
+    _table(pdf, ('', 'This Period', 'Previous', 'Change', 'Year Ago', 'Change'), rows,
+           col_widths=(48, 24, 24, 35, 24, 35), align=('L', 'R', 'R', 'R', 'R', 'R'))
+
+
+def render_report_pdf(report):
+    """
+    Builds the report PDF from generate_report_data() output (with transactions), with the
+    monthly budget fields app.report() adds and, optionally, generate_comparison_data() output
+    under 'comparison'. Everything is drawn as vector text and shapes.
+    """
+    pdf = ReportPDF(orientation='P', unit='mm', format='A4')
+    pdf.set_auto_page_break(auto=True, margin=MARGIN + 5)
+    pdf.set_margins(MARGIN, MARGIN, MARGIN)
+    pdf.set_title('Budget Report')
+    pdf.alias_nb_pages()
+    pdf.add_page()
+
+    pdf.set_font('Helvetica', 'B', 20)
+    pdf.cell(0, 12, 'Budget Report', align='C', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.set_font('Helvetica', '', 12)
+    period = str(report['period']).replace('_', ' ').capitalize()
+    pdf.cell(0, 8, _text(f"Report for: {period} ({report['start_date']} to {report['end_date']})"),
+             align='C', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.ln(6)
+
+    _stat_row(pdf, [('Period Income', report['total_income'], GREEN),
+                    ('Period Expense', report['total_expense'], RED),
+                    ('Period Balance', report['balance'], BLUE)])
+    _stat_row(pdf, [('Goal Savings', report['total_goal_savings'], PURPLE),
+                    ('General Savings', report['total_general_savings'], ORANGE)])
+
+    if report['period'] == 'monthly' and 'total_budget' in report:
+        _section_title(pdf, 'Monthly Budget Goals')
+        remaining = report['remaining_spending']
+        _stat_row(pdf, [('Total Budget', report['total_budget'], (0, 0, 0)),
+                        ('Savings Goal', report['savings_goal'], GREEN),
+                        ('Remaining to Spend', remaining, GREEN if remaining >= 0 else RED)])
+
+    _section_title(pdf, 'Expense Breakdown by Category')
+    _expense_pie(pdf, report.get('expense_breakdown_by_category') or {})
+
+    if report['period'] == 'yearly' and report.get('monthly_summaries'):
+        _section_title(pdf, 'Monthly Breakdown for the Year')
+        _table(pdf, ('Month', 'Income', 'Expense', 'Balance', 'Savings'),
+               [(m['month'], _money(m['total_income']), _money(m['total_expense']), _money(m['balance']),
+                 _money(m['total_savings'])) for m in report['monthly_summaries']],
+               col_widths=(40, 30, 30, 30, 30), align=('L', 'R', 'R', 'R', 'R'))
+
+    if report.get('comparison'):
+        _section_title(pdf, 'Compared with the Previous Period and Last Year')
+        _comparison(pdf, report['comparison'])
+
+    pdf.add_page()
+    _section_title(pdf, 'All Transactions Details')
+    transactions = report.get('transactions') or []
+    if transactions:
+        _table(pdf, ('Date', 'Type', 'Category', 'Item', 'Description', 'Amount'),
+               [(t['date'], str(t['type']).capitalize(), str(t['category']).capitalize(), t['item'],
+                 t['description'] or '', _money(t['amount'])) for t in transactions],
+               col_widths=(20, 15, 25, 35, 75, 20), align=('L', 'L', 'L', 'L', 'L', 'R'),
+               amount_colors=[GREEN if t['type'] == 'income' else RED for t in transactions])
+    else:
+        pdf.set_font('Helvetica', 'I', 10)
+        pdf.cell(0, 8, 'No transactions found for this period.')
+
+    return bytes(pdf.output())
@@ -2,6 +2,8 @@
 import json
 import os
 from datetime import datetime
+from decimal import Decimal
+import db
 
 # Get the absolute path for the directory where this script is located
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
@@ -22,9 +24,13 @@ def get_savings_goals():
         return []
 
 def save_savings_goals(goals):
-    """Saves the provided savings goals data to the JSON file."""
+    """Saves the provided savings goals data to the JSON file and tells live pages about the change."""
+    # index() recalculates the goals on every load; only a real change should rewrite the file and notify
+    if goals == get_savings_goals():
+        return
     with open(SAVINGS_GOALS_FILE, 'w') as f:
         json.dump(goals, f, indent=4)
+    db.notify_change('savings_goals')
 
 def get_savings_goal(goal_id):
     """Retrieves a single savings goal by its ID."""
@@ -65,30 +71,49 @@ def delete_savings_goal(goal_id):
     updated_goals = [g for g in goals if g.get('id') != goal_id]
     save_savings_goals(updated_goals)
 
-def update_saved_amount(goal_id, amount):
-    """Updates the saved amount for a savings goal."""
+def apply_saved_amount_increments(increments):
+    """Adds many {goal_id: amount} increments to the saved amounts with a single read and write of the goals file."""
+    if not increments:
+        return
     goals = get_savings_goals()
     for goal in goals:
-        if goal.get('id') == goal_id:
-            goal['saved_amount'] += amount
-            break
+        amount = increments.get(str(goal.get('id')))
+        if amount:
+            # The goals file stores floats; increments stay Decimal until written here
+            goal['saved_amount'] = float(Decimal(str(goal['saved_amount'])) + amount)
     save_savings_goals(goals)
 
-def recalculate_saved_amounts(transactions):
-    """Recalculates all saved amounts from transactions."""
-    goals = get_savings_goals()
-    for goal in goals:
-        goal['saved_amount'] = 0.0
-
+def aggregate_goal_increments(transactions):
+    """Sums 'Goal Savings' expense amounts per savings goal id."""
+    increments = {}
     for t in transactions:
         if t['type'] == 'expense' and t['category'] == 'Goal Savings' and t.get('savings_goal_id'):
-            for goal in goals:
-                if goal['id'] == t['savings_goal_id']:
-                    goal['saved_amount'] += t['amount']
-                    break
+            goal_id = str(t['savings_goal_id'])
+            increments[goal_id] = increments.get(goal_id, Decimal(0)) + Decimal(str(t['amount']))
+    return increments
+
+def diff_goal_increments(old_transactions, new_transactions):
+    """Per-goal change in saved amount when old_transactions are replaced by new_transactions."""
+    increments = aggregate_goal_increments(new_transactions)
+    for goal_id, amount in aggregate_goal_increments(old_transactions).items():
+        increments[goal_id] = increments.get(goal_id, Decimal(0)) - amount
+    return increments
+
+def recalculate_saved_amounts(transactions, archived_amounts=None):
+    """
+    Recalculates all saved amounts from transactions, starting from the amounts saved by archived
+    transactions ({goal id: amount}, see archive.goal_savings_totals()) that `transactions` no longer holds.
+    """
+    saved = aggregate_goal_increments(transactions)
+    for goal_id, amount in (archived_amounts or {}).items():
+        saved[str(goal_id)] = saved.get(str(goal_id), Decimal(0)) + Decimal(str(amount))
+    goals = get_savings_goals()
+    for goal in goals:
+        # The goals file stores floats; the sums are exact Decimals until here
+        goal['saved_amount'] = float(saved.get(str(goal['id']), 0))
     save_savings_goals(goals)
 
 def get_general_savings_total(transactions):
     """Calculates the total amount from all 'General Savings' expenses."""
-    total_general_savings = sum(t['amount'] for t in transactions if t['type'] == 'expense' and t['category'] == 'General Savings')
+    total_general_savings = sum(float(t['amount']) for t in transactions if t['type'] == 'expense' and t['category'] == 'General Savings')
     return total_general_savings
@@ -1,29 +1,34 @@
 import db
 
-def dict_from_row(row, cursor):
-    """Converts a database row into a dictionary."""
-    return dict(zip([col[0] for col in cursor.description], row))
+# Read on every page, so they are prepared once per connection (see db.execute_statement())
+STATEMENTS = {
+    'settings_monthly_savings_goal': "SELECT value FROM settings WHERE key = 'monthly_savings_goal';",
+    'settings_expense_categories': "SELECT name, icon FROM expense_categories ORDER BY name;",
+    'settings_income_categories': "SELECT name, icon FROM income_categories ORDER BY name;",
+}
+for name, query in STATEMENTS.items():
+    db.register_statement(name, query)
 
 def get_settings():
     """Reads settings from the database."""
-    conn = db.get_db_connection()
+    conn = db.get_read_connection()
     settings_data = {}
     try:
         with conn.cursor() as cur:
             # Get monthly_savings_goal
-            cur.execute("SELECT value FROM settings WHERE key = 'monthly_savings_goal';")
+            db.execute_statement(cur, 'settings_monthly_savings_goal')
             goal = cur.fetchone()
             settings_data['monthly_savings_goal'] = float(goal[0]) if goal else 100.0
 
             # Get expense categories and icons
-            cur.execute("SELECT name, icon FROM expense_categories ORDER BY name;")
+            db.execute_statement(cur, 'settings_expense_categories')
             expense_categories_rows = cur.fetchall()
             settings_data['expense_categories'] = [row[0] for row in expense_categories_rows]
             settings_data['category_icons'] = {row[0]: row[1] for row in expense_categories_rows}
             settings_data['category_icons']['_default'] = "fa-tags" # Ensure default icon is present
 
             # Get income categories and icons
-            cur.execute("SELECT name, icon FROM income_categories ORDER BY name;")
+            db.execute_statement(cur, 'settings_income_categories')
             income_categories_rows = cur.fetchall()
             settings_data['income_categories'] = [row[0] for row in income_categories_rows]
             settings_data['income_category_icons'] = {row[0]: row[1] for row in income_categories_rows}
@@ -0,0 +1,103 @@
+// Live page updates. Listens to the /events stream and, when data a page shows changes, re-renders
+// that page's [data-live-region] elements in place instead of reloading the whole page.
+//
+//   <div id="..." data-live-region="transactions savings_goals">  (an id is required)
+//
+// Only the affected regions are fetched: the page URL with ?live_region=<id> for each, which the
+// route answers with just those fragments (see render_live_regions() in app.py). Background tabs
+// wait until they are shown again, so a change costs one fetch per visible tab.
+//
+// Rows carrying data-row-id that weren't there before are briefly highlighted. Regions the user
+// is working in (focused, or with ticked checkboxes) are left alone until the next change.
+// After patching, a 'live:patched' event is dispatched on document so pages can redraw charts.
+(function() {
+    const script = document.currentScript;
+    if (!window.EventSource || !script || !document.querySelector('[data-live-region]')) {
+        return;
+    }
+
+    const pendingTables = new Set();
+    let timer = null;
+    // Generation of the newest transactions change already scheduled; replays at or below it are skipped
+    let lastGeneration = 0;
+
+    function isBusy(region) {
+        return region.contains(document.activeElement) || region.querySelector('input[type=checkbox]:checked');
+    }
+
+    async function patch() {
+        if (document.hidden) {
+            return;
+        }
+        const tables = new Set(pendingTables);
+        pendingTables.clear();
+        const regions = Array.from(document.querySelectorAll('[data-live-region]')).filter(function(region) {
+            const wanted = region.dataset.liveRegion.split(/\s+/);
+            return (tables.has('resync') || wanted.some(table => tables.has(table))) && !isBusy(region);
+        });
+        if (regions.length === 0) {
+            return;
+        }
+
+        const url = new URL(window.location.href);
+        regions.forEach(region => url.searchParams.append('live_region', region.id));
+        const response = await fetch(url, { headers: { 'X-Requested-With': 'fetch' } });
+        if (!response.ok) {
+            return;
+        }
+        const fresh = new DOMParser().parseFromString(await response.text(), 'text/html');
+        regions.forEach(function(region) {
+            const replacement = fresh.getElementById(region.id);
+            if (!replacement) {
+                return;
+            }
+            const known = new Set(Array.from(region.querySelectorAll('[data-row-id]'), row => row.dataset.rowId));
+            region.innerHTML = replacement.innerHTML;
+            region.querySelectorAll('[data-row-id]').forEach(function(row) {
+                if (!known.has(row.dataset.rowId)) {
+                    row.classList.add('live-new');
+                }
+            });
+        });
+        document.dispatchEvent(new CustomEvent('live:patched', { detail: { tables: Array.from(tables) } }));
+    }
+
+    function schedule(event) {
+        const generation = event.data ? JSON.parse(event.data).generation : null;
+        if (generation != null) {
+            if (generation <= lastGeneration) {
+                return;
+            }
+            lastGeneration = generation;
+        }
+        pendingTables.add(event.type);
+        // Bursts (a batch insert, a bulk edit) become one re-render
+        clearTimeout(timer);
+        timer = setTimeout(patch, 300);
+    }
+
+    // A refused stream (the server caps open streams per worker) closes for good instead of retrying
+    const REFUSED_RETRY_MS = 30000;
+
+    function connect() {
+        const source = new EventSource(script.dataset.eventsUrl);
+        ['transactions', 'savings_goals', 'resync'].forEach(name => source.addEventListener(name, schedule));
+        source.addEventListener('error', function() {
+            if (source.readyState === EventSource.CLOSED) {
+                setTimeout(function() {
+                    connect();
+                    // Changes made meanwhile were missed
+                    schedule({ type: 'resync' });
+                }, REFUSED_RETRY_MS * (1 + Math.random()));
+            }
+        });
+    }
+
+    document.addEventListener('visibilitychange', function() {
+        if (!document.hidden && pendingTables.size > 0) {
+            patch();
+        }
+    });
+
+    connect();
+})();
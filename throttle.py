@@ -0,0 +1,218 @@
+import os
+import tempfile
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from werkzeug.security import check_password_hash
+
+try:
+    import fcntl
+except ImportError:  # Windows: the development server is a single process, so the thread semaphore is enough
+    fcntl = None
+
+# Login attempts allowed in a burst, and how many seconds it takes to earn one back
+USERNAME_BURST = int(os.environ.get('LOGIN_USERNAME_BURST', 5))
+USERNAME_REFILL_SECONDS = float(os.environ.get('LOGIN_USERNAME_REFILL_SECONDS', 60))
+IP_BURST = int(os.environ.get('LOGIN_IP_BURST', 20))
+IP_REFILL_SECONDS = float(os.environ.get('LOGIN_IP_REFILL_SECONDS', 6))
+
+# Each pbkdf2:sha256:1000000 check costs about a second of CPU, so only a few may run at once on the host
+HASH_CONCURRENCY = int(os.environ.get('HASH_CONCURRENCY', 2))
+HASH_WAIT_SECONDS = float(os.environ.get('HASH_WAIT_SECONDS', 2))
+# One lock file per hashing slot, shared by every worker process on the host
+HASH_LOCK_DIR = os.environ.get('HASH_LOCK_DIR', os.path.join(tempfile.gettempdir(), 'budget-hash-slots'))
+
+# Query timeouts a user may cause in a burst before heavy pages refuse them, and how many seconds earn one back
+QUERY_TIMEOUT_BURST = int(os.environ.get('QUERY_TIMEOUT_BURST', 3))
+QUERY_TIMEOUT_REFILL_SECONDS = float(os.environ.get('QUERY_TIMEOUT_REFILL_SECONDS', 300))
+
+# Upper bound on tracked usernames/IPs so a stuffing run can't grow memory without limit
+MAX_TRACKED_KEYS = 10000
+
+
+
+class TooManyAttempts(Exception):
+    """Raised when a username or client has used up its login attempts."""
+
+
+class HashingBusy(Exception):
+    """Raised when no password hashing slot frees up in time."""
+
+
+class TooManyTimeouts(Exception):
+    """Raised when a user's recent requests kept running out of query time."""
+
+
+class TokenBucket:
+    """A bucket of `capacity` tokens that refills one token every `refill_seconds`."""
+    __slots__ = ('capacity', 'refill_seconds', 'tokens', 'updated')
+
+    def __init__(self, capacity, refill_seconds):
+        self.capacity = capacity
+        self.refill_seconds = refill_seconds
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        self.tokens = min(self.capacity, self.tokens + elapsed / self.refill_seconds)
+        self.updated = now
+
+    def consume(self, now=None):
+        """Takes one token. Returns False if the bucket is empty."""
+        self._refill(now if now is not None else time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class BucketMap:
+    """Thread-safe, size-bounded map of key -> TokenBucket."""
+
+    def __init__(self, capacity, refill_seconds, max_keys=MAX_TRACKED_KEYS):
+        self.capacity = capacity
+        self.refill_seconds = refill_seconds
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.capacity, self.refill_seconds)
+                self._buckets[key] = bucket
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket.consume()
+
+    def has_tokens(self, key):
+        """True if `key` could consume a token right now. Doesn't consume one."""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                return True
+            bucket._refill(time.monotonic())
+            return bucket.tokens >= 1
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+
+class HashSlots:
+    """
+    At most `count` holders at a time across all processes: a semaphore within the process, then an
+    flock on one of `count` lock files. The kernel drops the flock if its holder dies.
+    """
+
+    def __init__(self, count, lock_dir):
+        self.count = count
+        self.lock_dir = lock_dir
+        self._threads = threading.BoundedSemaphore(count)
+
+    def _lock_file(self, deadline):
+        """Locks a free slot file and returns its descriptor, or None if none frees up by the deadline."""
+        os.makedirs(self.lock_dir, exist_ok=True)
+        while True:
+            for slot in range(self.count):
+                # A descriptor per attempt: flock locks belong to the open file, which threads would share
+                fd = os.open(os.path.join(self.lock_dir, f'slot-{slot}.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fd
+                except BlockingIOError:
+                    os.close(fd)
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(0.05)
+
+    @contextmanager
+    def hold(self, timeout):
+        """Holds a slot for the duration of the block, raising HashingBusy if none frees up within `timeout`."""
+        deadline = time.monotonic() + timeout
+        if not self._threads.acquire(timeout=timeout):
+            raise HashingBusy()
+        fd = None
+        try:
+            if fcntl is not None:
+                fd = self._lock_file(deadline)
+                if fd is None:
+                    raise HashingBusy()
+            yield
+        finally:
+            if fd is not None:
+                os.close(fd)  # releases the flock
+            self._threads.release()
+
+
+_hash_slots = HashSlots(HASH_CONCURRENCY, HASH_LOCK_DIR)
+
+username_buckets = BucketMap(USERNAME_BURST, USERNAME_REFILL_SECONDS)
+ip_buckets = BucketMap(IP_BURST, IP_REFILL_SECONDS)
+query_timeout_buckets = BucketMap(QUERY_TIMEOUT_BURST, QUERY_TIMEOUT_REFILL_SECONDS)
+
+# (endpoint, reason) -> number of requests whose queries were cancelled, since the process started
+query_timeouts = Counter()
+_query_timeouts_lock = threading.Lock()
+
+# Rolling estimate of how long a real hash check takes, used to pad unknown-username rejects
+_verify_seconds = 1.0
+_verify_lock = threading.Lock()
+
+
+def check_login_allowed(username, client_ip):
+    """Consumes one attempt for both the username and the client IP, raising TooManyAttempts if either is exhausted."""
+    ip_ok = ip_buckets.consume(client_ip)
+    user_ok = username_buckets.consume(username.strip().lower())
+    if not (ip_ok and user_ok):
+        raise TooManyAttempts()
+
+
+def record_login_success(username):
+    """A successful login clears the username's failed-attempt history."""
+    username_buckets.reset(username.strip().lower())
+
+
+def verify_password(password_hash, password):
+    """Runs check_password_hash in one of the host-wide hashing slots."""
+    global _verify_seconds
+    with _hash_slots.hold(HASH_WAIT_SECONDS):
+        started = time.monotonic()
+        result = check_password_hash(password_hash, password)
+        elapsed = time.monotonic() - started
+    with _verify_lock:
+        _verify_seconds = 0.8 * _verify_seconds + 0.2 * elapsed
+    return result
+
+
+def reject_unknown_user(started):
+    """
+    Rejects a login for a username that doesn't exist without hashing anything. It takes a hashing
+    slot like a real check (so it gets HashingBusy under the same load) and sleeps in it, which costs
+    no CPU, until roughly a real check would have finished. Neither the status nor the timing of the
+    response reveals whether the username exists.
+    """
+    with _hash_slots.hold(HASH_WAIT_SECONDS):
+        remaining = _verify_seconds - (time.monotonic() - started)
+        if remaining > 0:
+            time.sleep(remaining)
+    return False
+
+
+def check_heavy_queries_allowed(user_id):
+    """Raises TooManyTimeouts if this user has used up their allowance of query timeouts."""
+    if not query_timeout_buckets.has_tokens(user_id):
+        raise TooManyTimeouts()
+
+
+def record_query_timeout(endpoint, reason, user_id=None):
+    """Counts a cancelled request; timeouts (not disconnects) also use up one of the user's allowance."""
+    with _query_timeouts_lock:
+        query_timeouts[(endpoint, reason)] += 1
+    if user_id is not None and reason == 'timeout':
+        query_timeout_buckets.consume(user_id)
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import re
+import sys
+import urllib.parse
+import urllib.request
+
+import assets
+
+# Relative url(...) references in vendored CSS, such as Font Awesome's ../webfonts/fa-solid-900.woff2
+CSS_RELATIVE_URL = re.compile(r"url\((['\"]?)(?!data:|https?:|/)([^)'\"]+)\1\)")
+# @import of a remote stylesheet, such as the Google Fonts import at the top of every Bootswatch theme
+CSS_REMOTE_IMPORT = re.compile(r"@import\s+url\((['\"]?)(https?://[^)'\"]+)\1\)\s*;?")
+# Absolute url(...) references in such an imported stylesheet (Google Fonts serves from fonts.gstatic.com)
+CSS_ABSOLUTE_URL = re.compile(r"url\((['\"]?)(https?://[^)'\"]+)\1\)")
+# Google Fonts picks the font format by User-Agent; this asks for woff2, which every supported browser reads
+FONTS_USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36'
+
+
+def _download(url):
+    request = urllib.request.Request(url, headers={'User-Agent': FONTS_USER_AGENT})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return response.read()
+
+
+def _write(path, body):
+    # Write then rename so a half-downloaded file is never served
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(body)
+    os.replace(path + '.tmp', path)
+
+
+def _vendor_file(url, filename, vendor_dir):
+    """Downloads url to vendor/<filename> unless it is there; returns its hashed name relative to vendor/."""
+    path = os.path.join(vendor_dir, filename)
+    if not os.path.exists(path):
+        _write(path, _download(url))
+    return assets.hashed_name(f'{assets.VENDOR_DIR}/{filename}')[len(assets.VENDOR_DIR) + 1:]
+
+
+def _inline_remote_imports(css, vendor_dir):
+    """
+    Replaces each @import of a remote stylesheet with that stylesheet's rules, its fonts vendored under
+    vendor/fonts/, so a page using the theme makes no third-party requests.
+    """
+
+    def inline(match):
+        imported = _download(match.group(2)).decode('utf-8')
+
+        def vendor(font_match):
+            # fonts.gstatic.com/s/<family>/<version>/<file>: the file name alone is unique
+            reference = urllib.parse.urlsplit(font_match.group(2)).path
+            return f'url({_vendor_file(font_match.group(2), f"fonts/{os.path.basename(reference)}", vendor_dir)})'
+
+        return CSS_ABSOLUTE_URL.sub(vendor, imported)
+
+    return CSS_REMOTE_IMPORT.sub(inline, css)
+
+
+def _vendor_css_files(css, css_url, vendor_dir):
+    """
+    Downloads the files a stylesheet loads by relative URL into vendor/<their directory>/ and points
+    the stylesheet at their content-hashed names, so they resolve next to /assets/vendor/<css>.
+    Remote @imports are inlined (see _inline_remote_imports()). Returns the rewritten stylesheet.
+    """
+
+    def vendor(match):
+        reference = match.group(2).split('?')[0].split('#')[0]
+        directory = os.path.basename(os.path.dirname(reference))
+        filename = f'{directory}/{os.path.basename(reference)}'
+        return f'url({_vendor_file(urllib.parse.urljoin(css_url, reference), filename, vendor_dir)})'
+
+    return _inline_remote_imports(CSS_RELATIVE_URL.sub(vendor, css), vendor_dir)
+
+
+def _vendored_files(vendor_dir):
+    """Paths of every vendored file relative to vendor_dir, sorted."""
+    return sorted(
+        os.path.relpath(os.path.join(directory, name), vendor_dir).replace(os.sep, '/')
+        for directory, _, names in os.walk(vendor_dir)
+        for name in names
+        if name != assets.VENDOR_CHECKSUMS and not name.endswith('.tmp')
+    )
+
+
+def _sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def vendor_assets(force=False):
+    """
+    Downloads the pinned third-party files in assets.VENDOR_ASSETS into static/vendor/, along with
+    the fonts their stylesheets load or @import, so pages work offline and load them from this server
+    (content-hashed, cached forever) instead of the CDNs. The files are committed with a
+    SHA256SUMS list; later runs stop if a file no longer matches it.
+    Run again after changing a pinned version; pass --force to re-download existing files.
+    """
+    vendor_dir = os.path.join(assets.STATIC_DIR, assets.VENDOR_DIR)
+    checksums_path = os.path.join(vendor_dir, assets.VENDOR_CHECKSUMS)
+    os.makedirs(vendor_dir, exist_ok=True)
+    known = {}
+    if os.path.exists(checksums_path):
+        with open(checksums_path) as f:
+            known = {name: digest for digest, name in (line.split(None, 1) for line in f.read().split('\n') if line)}
+
+    for filename, url in assets.VENDOR_ASSETS.items():
+        path = os.path.join(vendor_dir, filename)
+        if os.path.exists(path) and not force:
+            print(f"Skipping {filename}: already vendored.")
+            continue
+        body = _download(url)
+        if filename.endswith('.css'):
+            body = _vendor_css_files(body.decode('utf-8'), url, vendor_dir).encode('utf-8')
+        _write(path, body)
+        print(f"Vendored {filename} ({len(body)} bytes) from {url}")
+
+    digests = {}
+    for filename in _vendored_files(vendor_dir):
+        digests[filename] = _sha256(os.path.join(vendor_dir, filename))
+        if not force and filename in known and known[filename] != digests[filename]:
+            sys.exit(f"{filename} doesn't match {assets.VENDOR_CHECKSUMS}; re-run with --force to replace it.")
+    with open(checksums_path, 'w') as f:
+        f.writelines(f'{digest}  {filename}\n' for filename, digest in digests.items())
+
+if __name__ == '__main__':
+    vendor_assets(force='--force' in sys.argv[1:])